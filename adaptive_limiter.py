@@ -0,0 +1,77 @@
+import time
+import asyncio
+from collections import deque
+
+class AIMDLimiter:
+    """加性增、乘性减(AIMD)的自适应并发限制器。
+    响应正常时每完成约一轮(limit个)请求并发数+1；遇到403/429/5xx或延迟明显升高时并发数乘以decrease。
+    用法: async with limiter: ...，并把limiter.observe作为每次HTTP响应的回调"""
+
+    def __init__(self, initial=3, min_limit=1, max_limit=32, decrease=0.5, latency_factor=2.0, window=60):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.window = window
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+        self.completions = deque()  # 最近window秒内完成的时间戳，用于计算吞吐
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            self.completions.append(now)
+            while self.completions and self.completions[0] < now - self.window:
+                self.completions.popleft()
+            self.condition.notify_all()
+        return False
+
+    def is_congested(self, status: int, latency: float) -> bool:
+        if status in (403, 429) or status >= 500:
+            return True
+        return self.baseline_latency is not None and latency > self.baseline_latency * self.latency_factor
+
+    def observe(self, status: int, latency: float):
+        """记录一次HTTP响应的状态码和耗时(秒)，据此调整并发上限"""
+        now = time.monotonic()
+        if self.is_congested(status, latency):
+            # 同一波拥塞只减一次：距离上次减小不足一个基准延迟时忽略
+            cooldown = self.baseline_latency or latency
+            if now - self.last_decrease >= cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self.last_decrease = now
+            return
+
+        if 200 <= status < 400:
+            # 基准延迟用较慢的指数移动平均，避免被单次抖动带偏
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            else:
+                self.baseline_latency = self.baseline_latency * 0.95 + latency * 0.05
+        # 上限增加后，等待中的请求会在下一次释放时被唤醒
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def throughput(self) -> float:
+        """最近window秒内每秒完成的请求数"""
+        now = time.monotonic()
+        recent = [t for t in self.completions if t >= now - self.window]
+        if not recent:
+            return 0.0
+        return len(recent) / min(self.window, max(now - recent[0], 1))
+
+    def stats(self) -> str:
+        latency = f"{self.baseline_latency:.2f}s" if self.baseline_latency is not None else "-"
+        return (
+            f"并发上限 {int(self.limit)} (进行中 {self.in_flight}), "
+            f"吞吐 {self.throughput():.2f} 请求/秒, 基准延迟 {latency}"
+        )
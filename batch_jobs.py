@@ -0,0 +1,54 @@
+import os
+import json
+from typing import Dict, Tuple
+
+# OpenAI Batch API的请求格式：每行一个请求，custom_id用于把结果对应回请求
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+def make_custom_id(full_name: str, stage: str) -> str:
+    return f"{full_name}:{stage}"
+
+def split_custom_id(custom_id: str) -> Tuple[str, str]:
+    """custom_id -> (full_name, stage)，仓库名中不含冒号"""
+    full_name, _, stage = custom_id.rpartition(":")
+    return full_name, stage
+
+def build_batch_request(custom_id: str, model_config: dict, prompt: str, params: dict) -> Dict:
+    """与在线请求相同的请求体，包装成一行批量请求"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model_config["id"],
+            "messages": [{"role": "user", "content": prompt}],
+            **params
+        }
+    }
+
+def load_batch_results(path: str) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    """读取批量结果文件，返回(custom_id -> 响应体, custom_id -> 错误信息)。
+    响应体与在线请求返回的JSON格式相同；同一custom_id出现多次时保留最后一条"""
+    responses = {}
+    errors = {}
+    if not os.path.exists(path):
+        return responses, errors
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line.strip())
+                custom_id = record["custom_id"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+            response = record.get("response") or {}
+            body = response.get("body")
+            if response.get("status_code") == 200 and isinstance(body, dict) and body.get("choices"):
+                responses[custom_id] = body
+                errors.pop(custom_id, None)
+            else:
+                error = record.get("error") or body or f"HTTP {response.get('status_code')}"
+                errors[custom_id] = json.dumps(error, ensure_ascii=False) if not isinstance(error, str) else error
+    return responses, errors
+
+def response_content(body: dict) -> str:
+    return body["choices"][0]["message"].get("content") or ""
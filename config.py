@@ -1,25 +1,89 @@
 # LLM配置
 CURRENT_MODEL = "openai"  # 当前使用的模型
+# 同时使用的多个模型(MODEL_CONFIGS中的名称)，请求按观测到的延迟和错误率在其中分配，为空时只使用CURRENT_MODEL
+LLM_PROVIDERS = [
+    # "openai",
+    # "deepseek",
+]
 
 # 可用模型配置
 MODEL_CONFIGS = {
     "deepseek": {
         "id": "deepseek-chat",
         "url": "https://api.deepseek.com/v1/chat/completions",
-        "api_key": "sk-XXX"
+        "api_key": "sk-XXX",
+        "readme_token_budget": 8000,  # 提示词中README内容的token预算
+        "price_per_million": {"prompt": 0.27, "completion": 1.10},  # 每百万token价格(美元)，用于估算费用
+        "max_concurrent": 20,          # 该模型的并发上限，未配置时为LLM_MAX_CONCURRENT
+        "tokens_per_minute": 1000000,  # 每分钟token预算，0表示不限制
+        "response_format": "json_object"  # 支持的结构化输出类型: json_schema/json_object，不支持时不配置
     },
     "openai": {
         "id": "gpt-4o",
         "url": "https://agent.aigc369.com/v1/chat/completions",
-        "api_key": "sk-XXX"
+        "api_key": "sk-XXX",
+        "readme_token_budget": 12000,
+        "price_per_million": {"prompt": 2.50, "completion": 10.00},
+        "max_concurrent": 50,
+        "tokens_per_minute": 800000,
+        "response_format": "json_schema"
     }
     # 可以添加更多模型配置
 } 
 
 # GitHub配置
 GITHUB_TOKEN = "ghp_XXX"
+# 多个token轮换使用(每个请求路由到剩余配额最多的token)，为空时只使用GITHUB_TOKEN
+GITHUB_TOKENS = [
+    # "ghp_XXX",
+    # "ghp_YYY",
+]
 
 # 并发和重试配置
 MAX_CONCURRENT = 50
+LLM_MAX_CONCURRENT = 50  # 每个模型默认的LLM并发请求数(分析、README生成、easy install共享)
+LLM_FAILURE_THRESHOLD = 5       # 模型连续失败多少次后熔断
+LLM_CIRCUIT_COOLDOWN = 60       # 熔断持续秒数，之后先放行一个探测请求
+LLM_COMPLETION_TOKEN_ESTIMATE = 2000  # 预估每次请求输出的token数，用于每分钟token预算
+
+# 两级分析：先用便宜的模型以简短提示词初筛，只有MCP服务器或把握不足的仓库才用强模型做完整分析和README生成
+TRIAGE_ENABLED = False          # 默认关闭，确认初筛模型的准确率后再开启
+TRIAGE_MODEL = "deepseek"            # 初筛使用的模型(MODEL_CONFIGS中的名称)
+TRIAGE_CONFIDENCE_THRESHOLD = 80     # 初筛把握程度低于该值时升级到完整分析
+TRIAGE_README_TOKENS = 1500          # 初筛提示词中README的token预算
+TRIAGE_BATCH_SIZE = 8                # 每个初筛请求包含的仓库数，1表示逐个初筛
+TRIAGE_BATCH_WAIT = 2.0              # 凑批最多等待的秒数
+TRIAGE_BATCH_README_TOKENS = 600     # 批量初筛时每个仓库README的token预算
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # 重试等待秒数 
\ No newline at end of file
+RETRY_DELAY = 5  # 重试等待秒数
+
+# LLM响应缓存配置(相同模型+提示词+参数直接返回缓存结果)
+LLM_CACHE_ENABLED = True
+LLM_CACHE_FILE = "results/llm_cache.db"
+LLM_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 缓存总大小上限(字节)
+LLM_CACHE_MAX_AGE_DAYS = 30                   # 缓存有效期(天) 
+
+# 本地预筛选配置(调用LLM前按README/描述中的MCP特征打分，明确无关的仓库直接归入non_mcp)
+PREFILTER_ENABLED = True
+PREFILTER_REJECT_SCORE = 0  # 命中负向特征且得分不高于该值的仓库视为与MCP无关
+PREFILTER_EVAL_SAMPLE = 200 # 启动时抽取多少个已由LLM标注的仓库评估预筛选准确率(需读取其README)，0表示不评估
+
+# easy install判断：默认按确定性规则判断，规则无法确定时是否调用LLM
+EASY_INSTALL_LLM_FALLBACK = True
+
+# 处理状态库(所有阶段共用，记录每个仓库在每个阶段的处理状态)
+STATE_DB_FILE = "pipeline_state.db"
+STATE_MAX_ATTEMPTS = 1  # 失败的仓库最多尝试几次，1表示失败后不再重试
+
+# 批量(离线)模式：None为在线逐个请求；"submit"把待分析仓库的提示词写成OpenAI Batch格式的请求文件，
+# "ingest"读取批量结果文件并按在线模式相同的流程保存结果(需要第二轮请求的仓库再次submit即可)
+BATCH_MODE = None
+BATCH_MODEL = "openai"  # 批量请求使用的模型(MODEL_CONFIGS中的名称)
+
+# 流式请求：按两次数据之间的空闲时间判断超时，收到期望的结束标签后立即停止读取
+LLM_STREAM = True
+LLM_CONNECT_TIMEOUT = 10  # 建立连接的超时秒数
+LLM_IDLE_TIMEOUT = 30     # 流式响应两次数据之间的最长等待秒数
+
+# LLM输出格式："json"使用结构化JSON输出(provider支持时通过response_format约束)，"xml"为原来的XML格式
+LLM_OUTPUT_FORMAT = "json"
@@ -0,0 +1,129 @@
+import re
+import json
+from typing import Dict, Optional, Tuple, Union
+
+# 只有这几种标准包管理器/容器化方式视为容易安装
+EASY_INSTALL_COMMANDS = {"npx", "uvx", "docker"}
+
+# 明确指向本地文件系统的参数或环境变量值
+PATH_PATTERN = re.compile(
+    r"^(/|~[/\\]|\.{1,2}[/\\]|[a-zA-Z]:[\\/]|\\\\)"       # 绝对路径、家目录、相对路径、Windows盘符、UNC
+    r"|[/\\](Users|home|tmp|var|opt|mnt|Documents|Desktop)[/\\]"
+    r"|path[/\\]to|/your[-_/]|<[^>]*(path|dir|folder|file)[^>]*>"
+    r"|\$\{?(workspaceFolder|HOME|PWD|userHome)\}?",
+    re.I
+)
+# 带文件后缀的相对路径，例如 dist/index.js、src/server.py
+RELATIVE_FILE_PATTERN = re.compile(r"^[\w.\-]+([/\\][\w.\-]+)+\.(js|mjs|cjs|ts|py|json|ya?ml|toml|sh|jar|exe)$", re.I)
+# 单独的文件名，例如 config.yaml，可能是本地文件也可能是镜像/包内的文件，无法确定
+BARE_FILE_PATTERN = re.compile(r"^[\w\-]+\.(js|mjs|cjs|ts|py|json|ya?ml|toml|sh|jar|exe|db|sqlite)$", re.I)
+# 名称表明需要本地路径的环境变量
+PATH_ENV_KEY_PATTERN = re.compile(r"(^|_)(PATH|DIR|DIRECTORY|FOLDER|FILE|ROOT)S?$", re.I)
+# docker挂载本地目录的参数
+DOCKER_MOUNT_ARGS = {"-v", "--volume", "--mount"}
+# 需要先手动下载仓库代码的迹象
+CLONE_PATTERN = re.compile(r"\bgit\s+clone\b|--directory\b", re.I)
+
+def check_structure(command_json) -> Optional[str]:
+    """检查server_command的基本结构，合法时返回None，否则返回原因"""
+    if not isinstance(command_json, dict):
+        return "server_command不是JSON对象"
+    if "mcpServers" not in command_json:
+        return "缺少mcpServers字段"
+    if not isinstance(command_json["mcpServers"], dict) or not command_json["mcpServers"]:
+        return "mcpServers不是非空对象"
+    for server_name, server_config in command_json["mcpServers"].items():
+        if not isinstance(server_config, dict):
+            return f"{server_name} 的配置不是JSON对象"
+        if "command" not in server_config:
+            return f"{server_name} 缺少command字段"
+        if "args" in server_config and not isinstance(server_config["args"], list):
+            return f"{server_name} 的args不是列表"
+        if "env" in server_config and not isinstance(server_config["env"], dict):
+            return f"{server_name} 的env不是对象"
+    return None
+
+def parse_server_command(server_command: Union[Dict, str]) -> Tuple[Optional[Dict], Optional[str]]:
+    """解析server_command(字典或JSON字符串)，返回(配置, 错误原因)"""
+    if isinstance(server_command, str):
+        try:
+            server_command = json.loads(server_command.strip())
+        except json.JSONDecodeError as e:
+            return None, f"server_command JSON解析失败: {str(e)}"
+    error = check_structure(server_command)
+    if error is not None:
+        return None, error
+    return server_command, None
+
+def looks_like_path(value: str) -> bool:
+    if not isinstance(value, str) or re.match(r"^[a-z][a-z0-9+.\-]*://", value, re.I):
+        return False
+    # --config=/path/to/file 这类参数只看等号后面的部分
+    if value.startswith("-") and "=" in value:
+        value = value.split("=", 1)[1]
+    return bool(PATH_PATTERN.search(value) or RELATIVE_FILE_PATTERN.match(value))
+
+def is_bind_mount(value: str) -> bool:
+    """docker -v/--mount 是否挂载本地目录(命名卷不需要本地文件)"""
+    if "type=bind" in value or re.search(r"(source|src)=[^,]*[/\\]", value):
+        return True
+    return looks_like_path(value.split(":", 1)[0])
+
+def evaluate_server(server_name: str, config: Dict) -> Tuple[Optional[bool], str]:
+    command = str(config["command"]).strip()
+    program = re.split(r"[/\\]", command.split()[0])[-1].lower() if command else ""
+    if program.endswith(".exe") or program.endswith(".cmd"):
+        program = program.rsplit(".", 1)[0]
+    if program not in EASY_INSTALL_COMMANDS:
+        if looks_like_path(command):
+            return False, f"{server_name} 的command是本地路径 {command}，需要先下载代码"
+        return False, f"{server_name} 的command为 {command}，不是npx/uvx/docker"
+
+    args = config.get("args") or []
+    env = config.get("env") or {}
+    ambiguous = None
+
+    for i, arg in enumerate(args):
+        if not isinstance(arg, str):
+            ambiguous = ambiguous or f"{server_name} 的参数 {arg!r} 不是字符串"
+            continue
+        if CLONE_PATTERN.search(arg):
+            return False, f"{server_name} 需要先手动下载仓库代码(参数 {arg})"
+        if looks_like_path(arg):
+            return False, f"{server_name} 的参数需要指定本地路径: {arg}"
+        if program == "docker" and i > 0 and args[i - 1] in DOCKER_MOUNT_ARGS and is_bind_mount(arg):
+            return False, f"{server_name} 需要挂载本地目录: {arg}"
+        if BARE_FILE_PATTERN.match(arg):
+            ambiguous = ambiguous or f"{server_name} 的参数 {arg} 可能是本地文件"
+
+    for key, value in env.items():
+        if looks_like_path(value):
+            return False, f"{server_name} 的环境变量 {key} 需要指定本地路径: {value}"
+        if PATH_ENV_KEY_PATTERN.search(key) and not re.match(r"^[a-z][a-z0-9+.\-]*://", str(value), re.I):
+            return False, f"{server_name} 的环境变量 {key} 需要用户指定本地路径"
+        if not isinstance(value, str):
+            ambiguous = ambiguous or f"{server_name} 的环境变量 {key} 不是字符串"
+
+    if ambiguous:
+        return None, ambiguous
+    return True, f"{server_name} 使用 {program} 启动，无需本地文件配置"
+
+def evaluate_easy_install(server_command: Union[Dict, str]) -> Tuple[Optional[bool], str]:
+    """按规则判断server_command是否容易安装，返回(is_easy_install, 原因)。
+    所有服务器都必须容易安装才为True；规则无法确定时返回(None, 原因)，由调用方决定是否交给LLM判断"""
+    config, error = parse_server_command(server_command)
+    if config is None:
+        return False, error
+
+    ambiguous = None
+    reasons = []
+    for server_name, server_config in config["mcpServers"].items():
+        is_easy, reason = evaluate_server(server_name, server_config)
+        if is_easy is False:
+            return False, reason
+        if is_easy is None:
+            ambiguous = ambiguous or reason
+        reasons.append(reason)
+    if ambiguous:
+        return None, ambiguous
+    return True, "; ".join(reasons)
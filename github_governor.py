@@ -0,0 +1,199 @@
+import time
+import asyncio
+from datetime import datetime
+import config
+
+# 当剩余配额低于该值时直接等待重置，为其他进程/手动调用留一点余量
+RESERVE_REQUESTS = 1
+# 被限流后最多重新排队的次数
+MAX_THROTTLE_RETRIES = 10
+# 二级限流没有给出Retry-After时的默认等待时间(秒)
+DEFAULT_RETRY_AFTER = 60
+
+async def log(message):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+class RateBucket:
+    """单个token在单个资源(core/search/graphql)上的配额状态"""
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = 0.0
+        self.next_time = 0.0
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def resume_at(self) -> float:
+        """配额耗尽或被限流时恢复可用的时间"""
+        if self.remaining is not None and self.remaining <= RESERVE_REQUESTS and self.reset > time.time():
+            return max(self.reset + 1, self.blocked_until)
+        return self.blocked_until
+
+    def available_at(self) -> float:
+        """下一次可以发请求的时间(同时考虑均匀节奏)"""
+        return max(self.resume_at(), self.next_time)
+
+class RateLimitGovernor:
+    """根据响应头中的X-RateLimit-*跟踪每个token、每个资源的剩余配额，
+    每次请求路由到剩余配额最多的token，并把配额均匀分摊到重置之前"""
+
+    def __init__(self, tokens):
+        self.tokens = [token for token in tokens if token]
+        self.buckets = {}
+
+    def bucket(self, resource: str, token: str) -> RateBucket:
+        key = (token, resource)
+        if key not in self.buckets:
+            self.buckets[key] = RateBucket()
+        return self.buckets[key]
+
+    def pick_token(self, resource: str) -> str:
+        """选择当前可用且剩余配额最多的token；全部不可用时选择最早恢复的token"""
+        if not self.tokens:
+            raise RuntimeError("没有可用的GitHub token，请检查config.GITHUB_TOKENS")
+        now = time.time()
+
+        def score(token):
+            bucket = self.bucket(resource, token)
+            available_at = bucket.available_at()
+            if available_at > now:
+                return (0, -available_at)
+            if bucket.remaining is None or bucket.reset <= now:
+                # 还没有响应头或已经重置，视为满配额
+                return (1, float("inf"))
+            return (1, bucket.remaining)
+
+        return max(self.tokens, key=score)
+
+    async def acquire(self, resource: str) -> str:
+        """在发出请求前调用，选择token并按其剩余配额控制请求节奏，返回选中的token"""
+        token = self.pick_token(resource)
+        bucket = self.bucket(resource, token)
+        async with bucket.lock:
+            now = time.time()
+            wait_until = bucket.resume_at()
+            if wait_until > now:
+                await log(f"{resource} 所有token配额均已耗尽或被限流，等待 {wait_until - now:.0f} 秒...")
+                await asyncio.sleep(wait_until - now)
+                now = time.time()
+                if bucket.reset <= now:
+                    bucket.remaining = None
+                    bucket.next_time = 0.0
+
+            if bucket.remaining is None:
+                # 还没有收到过响应头，无法估算节奏
+                return token
+
+            # 剩余配额在重置前均匀使用
+            if bucket.next_time > now:
+                await asyncio.sleep(bucket.next_time - now)
+                now = time.time()
+            interval = max(bucket.reset - now, 0) / max(bucket.remaining - RESERVE_REQUESTS, 1)
+            bucket.next_time = now + interval
+            bucket.remaining -= 1
+        return token
+
+    def update(self, headers, default_resource: str, token: str) -> str:
+        """用响应头更新token的配额状态，返回响应所属的资源名"""
+        resource = headers.get("X-RateLimit-Resource", default_resource)
+        if "X-RateLimit-Remaining" not in headers:
+            return resource
+        bucket = self.bucket(resource, token)
+        try:
+            bucket.remaining = int(headers["X-RateLimit-Remaining"])
+            bucket.limit = int(headers.get("X-RateLimit-Limit", 0)) or bucket.limit
+            bucket.reset = float(headers.get("X-RateLimit-Reset", 0))
+        except ValueError:
+            pass
+        return resource
+
+    async def backoff(self, resource: str, headers, token: str):
+        """token被限流后暂停使用：优先使用Retry-After(二级限流)，否则等到配额重置；
+        其他token仍可继续使用，等待由acquire统一处理"""
+        bucket = self.bucket(resource, token)
+        retry_after = headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                wait_time = float(retry_after)
+            except ValueError:
+                wait_time = DEFAULT_RETRY_AFTER
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            wait_time = max(float(headers.get("X-RateLimit-Reset", 0)) - time.time(), 0) + 5
+        else:
+            wait_time = DEFAULT_RETRY_AFTER
+
+        await log(f"{resource} 触发限流(token ...{token[-4:]})，暂停该token {wait_time:.0f} 秒，请求重新排队...")
+        bucket.blocked_until = max(bucket.blocked_until, time.time() + wait_time)
+
+    async def disable(self, token: str):
+        """token认证失败(401)时将其移出轮换"""
+        if token in self.tokens:
+            self.tokens.remove(token)
+            await log(f"GitHub token ...{token[-4:]} 认证失败，已移出轮换，剩余 {len(self.tokens)} 个token")
+
+def is_rate_limited(status: int, headers, data=None) -> bool:
+    """判断响应是否为限流(主限流、二级限流或GraphQL的RATE_LIMITED错误)"""
+    if status == 429:
+        return True
+    if status == 403:
+        if headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in headers:
+            return True
+        message = data.get("message", "") if isinstance(data, dict) else str(data or "")
+        return "rate limit" in message.lower()
+    if status == 200 and isinstance(data, dict) and data.get("errors"):
+        return any(error.get("type") == "RATE_LIMITED" for error in data["errors"])
+    return False
+
+default_governor = RateLimitGovernor(config.GITHUB_TOKENS or [config.GITHUB_TOKEN])
+
+async def github_request(session, method, url, resource="core", governor=None, headers=None, cache=None, on_response=None, **kwargs):
+    """经过配额控制的GitHub请求，自动选择token；被限流时重新排队发送同一请求而不是丢弃，
+    token认证失败时换用其他token，返回(状态码, 数据, 响应头)。
+    传入cache(http_cache.ConditionalCache)时对GET请求发送If-None-Match，304时返回缓存的数据和200；
+    传入on_response(status, latency)时每次实际收到响应(包括被限流的响应)都会回调"""
+    governor = governor or default_governor
+    throttle_retries = 0
+    cached = cache.get(url) if cache is not None and method == "GET" else None
+
+    while True:
+        token = await governor.acquire(resource)
+        request_headers = dict(headers or {})
+        request_headers["Authorization"] = f"token {token}"
+        if cached:
+            request_headers["If-None-Match"] = cached["etag"]
+
+        start_time = time.monotonic()
+        async with session.request(method, url, headers=request_headers, **kwargs) as resp:
+            if resp.content_type == "application/json":
+                data = await resp.json()
+            else:
+                data = await resp.text()
+            response_headers = resp.headers
+            status = resp.status
+        if on_response is not None:
+            on_response(status, time.monotonic() - start_time)
+
+        if status == 401:
+            await governor.disable(token)
+            if governor.tokens:
+                continue
+            return status, data, response_headers
+
+        resource = governor.update(response_headers, resource, token)
+        if status == 304 and cached:
+            cache.hits += 1
+            return 200, cached["data"], response_headers
+        if not is_rate_limited(status, response_headers, data):
+            if cache is not None and method == "GET" and status == 200:
+                cache.misses += 1
+                if response_headers.get("ETag"):
+                    cache.put(url, response_headers["ETag"], data)
+            return status, data, response_headers
+
+        if throttle_retries >= MAX_THROTTLE_RETRIES:
+            await log(f"{resource} 限流重试次数已用完: {url}")
+            return status, data, response_headers
+        throttle_retries += 1
+        await governor.backoff(resource, response_headers, token)
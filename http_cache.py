@@ -0,0 +1,50 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+
+CACHE_DIR = ".http_cache"
+
+class ConditionalCache:
+    """按URL保存响应体和ETag的磁盘缓存，用于发送If-None-Match条件请求；
+    GitHub对304响应不计入配额，未变化的资源几乎不消耗请求次数"""
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, url: str) -> str:
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        # 按前两位分目录，避免单个目录下文件过多
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json")
+
+    def get(self, url: str):
+        """返回缓存条目 {"etag", "data", "stored_at"}，没有缓存时返回None"""
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+
+    def put(self, url: str, etag: str, data):
+        """保存响应，先写临时文件再替换，避免并发读到半个文件"""
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "url": url,
+                "etag": etag,
+                "data": data,
+                "stored_at": datetime.now().isoformat()
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"HTTP缓存命中 {self.hits}/{total} ({rate:.1f}%)"
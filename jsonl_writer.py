@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import asyncio
+
+FLUSH_SIZE = 200       # 缓冲区达到多少行时写入
+FLUSH_INTERVAL = 1.0   # 最多缓冲多少秒后写入
+
+class JsonlWriter:
+    """单个输出文件的唯一写入者：记录先进入asyncio队列，由后台任务批量写入。
+    每条记录在入队前就序列化成完整的一行，多个协程并发写入也不会交错；
+    文件写入放在线程中执行，不阻塞事件循环"""
+
+    def __init__(self, path: str, mode: str = "a", flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.mode = mode
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = None
+        self.task = None
+        self.file = None
+        self.error = None
+        self.lines_written = 0
+
+    def _ensure_started(self):
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run())
+
+    def write(self, record: dict):
+        """写入一条JSON记录"""
+        self.write_line(json.dumps(record, ensure_ascii=False))
+
+    def write_line(self, text: str):
+        """写入一行文本(不含换行符)"""
+        self._ensure_started()
+        self.queue.put_nowait(("line", text + "\n"))
+
+    async def checkpoint(self):
+        """把已入队的记录全部写入并fsync到磁盘"""
+        if self.task is None:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(("checkpoint", future))
+        await future
+
+    async def close(self):
+        """写完剩余记录后关闭文件"""
+        if self.task is None:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(("close", future))
+        await future
+        await self.task
+        self.task = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 上次异常退出可能留下不完整的最后一行，先补一个换行，保证新记录从行首开始
+        needs_newline = False
+        if self.mode == "a" and os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self.file = open(self.path, self.mode, encoding="utf-8")
+        if needs_newline:
+            self.file.write("\n")
+
+    def _write(self, data: str, sync: bool = False):
+        if self.file is None:
+            self._open()
+        if data:
+            self.file.write(data)
+            self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def _close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+    async def _run(self):
+        buffer = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                kind, payload = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                kind, payload = "flush", None
+
+            if kind == "line":
+                buffer.append(payload)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(buffer) < self.flush_size:
+                    continue
+
+            data = "".join(buffer)
+            self.lines_written += len(buffer)
+            buffer = []
+            deadline = None
+
+            try:
+                if kind == "close":
+                    await asyncio.to_thread(self._write, data)
+                    await asyncio.to_thread(self._close)
+                else:
+                    await asyncio.to_thread(self._write, data, kind == "checkpoint")
+            except Exception as e:
+                # 写入失败时保留错误，在下一次checkpoint/close时抛给调用方
+                self.error = e
+
+            # 等待方可能已被取消(例如进度协程被cancel)，此时不再设置结果
+            if kind in ("checkpoint", "close") and not payload.done():
+                if self.error is not None:
+                    payload.set_exception(self.error)
+                    self.error = None
+                else:
+                    payload.set_result(None)
+            if kind == "close":
+                return
+
+def compact_jsonl(path: str, key: str) -> int:
+    """按key合并JSONL文件中的重复记录，同一key保留最后一条(位置按首次出现)，返回合并后的记录数"""
+    if not os.path.exists(path):
+        return 0
+    records = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line.strip())
+                record_key = record[key]
+            except (json.JSONDecodeError, KeyError):
+                continue
+            records[record_key] = record
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records.values():
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return len(records)
+
+class WriterPool:
+    """按文件路径管理JsonlWriter，保证每个输出文件只有一个写入者"""
+
+    def __init__(self):
+        self.writers = {}
+
+    def get(self, path: str, mode: str = "a") -> JsonlWriter:
+        if path not in self.writers:
+            self.writers[path] = JsonlWriter(path, mode)
+        return self.writers[path]
+
+    async def checkpoint_all(self):
+        await asyncio.gather(*(writer.checkpoint() for writer in self.writers.values()))
+
+    async def close_all(self):
+        await asyncio.gather(*(writer.close() for writer in self.writers.values()))
+        self.writers = {}
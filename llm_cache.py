@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+EVICT_EVERY = 200  # 每写入多少条检查一次淘汰
+
+def make_cache_key(model_config: dict, prompt: str, params: dict) -> str:
+    """由模型(id和url)、提示词和请求参数计算缓存键"""
+    payload = json.dumps({
+        "model": model_config["id"],
+        "url": model_config["url"],
+        "prompt": prompt,
+        "params": params or {}
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """基于SQLite的LLM响应缓存，按模型+提示词+参数的哈希命中；
+    超过max_age_days的条目过期，总大小超过max_bytes时按最近访问时间淘汰"""
+
+    def __init__(self, path: str, max_bytes: int, max_age_days: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+        self.conn.commit()
+        self.evict()
+
+    def get(self, model_config: dict, prompt: str, params: dict = None):
+        """返回缓存的响应JSON，未命中或已过期时返回None"""
+        key = make_cache_key(model_config, prompt, params)
+        row = self.conn.execute(
+            "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.max_age:
+            self.misses += 1
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, model_config: dict, prompt: str, params: dict, response: dict):
+        key = make_cache_key(model_config, prompt, params)
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_config["id"], data, len(data.encode("utf-8")), now, now)
+            )
+        self.puts_since_evict += 1
+        if self.puts_since_evict >= EVICT_EVERY:
+            self.evict()
+
+    def discard(self, model_config: dict, prompt: str, params: dict = None):
+        """删除某个提示词的缓存(例如缓存的响应解析失败，需要重新请求时)"""
+        key = make_cache_key(model_config, prompt, params)
+        with self.conn:
+            self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+    def evict(self):
+        """删除过期条目，并按最近访问时间淘汰直到总大小不超过max_bytes"""
+        self.puts_since_evict = 0
+        with self.conn:
+            self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.max_age,))
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self.conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall()
+            to_delete = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                total -= size
+            self.conn.executemany("DELETE FROM llm_cache WHERE key = ?", to_delete)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"LLM缓存命中 {self.hits}/{total} ({rate:.1f}%)"
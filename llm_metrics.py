@@ -0,0 +1,76 @@
+import math
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩法计算百分位数，values为空时返回0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+def estimate_cost(model_config: dict, prompt_tokens: int, completion_tokens: int) -> float:
+    """按模型配置中的每百万token价格估算费用(美元)，未配置价格时为0"""
+    price = model_config.get("price_per_million") or {}
+    return (prompt_tokens * price.get("prompt", 0) + completion_tokens * price.get("completion", 0)) / 1_000_000
+
+class LLMMetrics:
+    """记录每次LLM调用的阶段、模型、状态码、重试次数、排队和网络耗时、token用量和费用。
+    每条记录写入metrics JSONL(带run_id，便于比较不同运行)，运行结束时按阶段汇总"""
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.records = defaultdict(list)  # 阶段 -> 本次运行的记录
+
+    def record(self, stage: str, model_config: dict, status=None, retries: int = 0, queue_wait: float = 0.0,
+               network_time: float = 0.0, usage: dict = None, cached: bool = False, error: str = None) -> Dict:
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        record = {
+            "run_id": self.run_id,
+            "time": datetime.now().isoformat(),
+            "stage": stage,
+            "model": model_config["id"],
+            "status": status,
+            "retries": retries,
+            "cached": cached,
+            "queue_wait": round(queue_wait, 3),
+            "network_time": round(network_time, 3),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            # 命中缓存时没有实际请求，不计费用
+            "cost": 0.0 if cached else estimate_cost(model_config, prompt_tokens, completion_tokens),
+            "error": error
+        }
+        self.records[stage].append(record)
+        if self.writer is not None:
+            self.writer.write(record)
+        return record
+
+    def summary(self) -> List[str]:
+        """每个阶段一行汇总：调用数、失败和缓存命中数、延迟百分位、平均排队时间、token和费用"""
+        lines = []
+        total_cost = 0.0
+        for stage, records in sorted(self.records.items()):
+            requested = [r for r in records if not r["cached"]]
+            latencies = [r["queue_wait"] + r["network_time"] for r in requested]
+            queue_waits = [r["queue_wait"] for r in requested]
+            prompt_tokens = sum(r["prompt_tokens"] for r in records)
+            completion_tokens = sum(r["completion_tokens"] for r in records)
+            cost = sum(r["cost"] for r in records)
+            total_cost += cost
+            lines.append(
+                f"{stage}: 调用 {len(records)} 次 (缓存 {len(records) - len(requested)}, "
+                f"失败 {sum(1 for r in records if r['error'])}, 重试 {sum(r['retries'] for r in records)}), "
+                f"延迟 p50 {percentile(latencies, 50):.2f}s / p95 {percentile(latencies, 95):.2f}s / "
+                f"p99 {percentile(latencies, 99):.2f}s, "
+                f"平均排队 {sum(queue_waits) / len(queue_waits) if queue_waits else 0:.2f}s, "
+                f"token {prompt_tokens}+{completion_tokens}, 费用 ${cost:.4f}"
+            )
+        if lines:
+            lines.append(f"预估总费用: ${total_cost:.4f}")
+        return lines
@@ -0,0 +1,154 @@
+import time
+import asyncio
+from collections import deque
+from typing import Dict, List
+
+TPM_WINDOW = 60        # tokens-per-minute统计窗口(秒)
+EWMA_ALPHA = 0.2       # 延迟和错误率的指数移动平均系数
+WAIT_INTERVAL = 1.0    # 没有可用provider时的最长等待间隔(秒)，用于窗口过期和熔断恢复
+
+class ProviderState:
+    """单个LLM provider的并发、token配额和健康状态"""
+
+    def __init__(self, name: str, config: dict, max_concurrent: int, tokens_per_minute: int):
+        self.name = name
+        self.config = config
+        self.max_concurrent = max_concurrent
+        self.tokens_per_minute = tokens_per_minute
+        self.in_flight = 0
+        self.tokens = deque()         # (时间, token数)，最近TPM_WINDOW秒内的用量
+        self.latency = None           # 延迟的EWMA(秒)
+        self.error_rate = 0.0         # 错误率的EWMA
+        self.failures = 0             # 连续失败次数
+        self.open_until = 0.0         # 熔断到期时间，到期后进入半开状态，成功一次后恢复为0
+        self.requests = 0
+        self.errors = 0
+
+    def tokens_in_window(self, now: float) -> int:
+        while self.tokens and self.tokens[0][0] < now - TPM_WINDOW:
+            self.tokens.popleft()
+        return sum(tokens for _, tokens in self.tokens)
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def is_half_open(self, now: float) -> bool:
+        return 0 < self.open_until <= now
+
+    def available(self, now: float, estimated_tokens: int) -> bool:
+        if self.is_open(now):
+            return False
+        # 半开状态只放行一个探测请求
+        limit = 1 if self.is_half_open(now) else self.max_concurrent
+        if self.in_flight >= limit:
+            return False
+        if self.tokens_per_minute:
+            used = self.tokens_in_window(now)
+            # 单个请求超过整个配额时，只要窗口为空就放行，避免永远等待
+            if used and used + estimated_tokens > self.tokens_per_minute:
+                return False
+        return True
+
+    def score(self) -> float:
+        """越小越优先：按观测延迟、当前负载和错误率综合排序，没有数据的provider优先试探"""
+        latency = self.latency if self.latency is not None else 0.0
+        load = self.in_flight / self.max_concurrent
+        return (latency * (1 + load) + load + self.error_rate) / max(1 - self.error_rate, 0.05)
+
+class LLMRouter:
+    """在多个LLM provider之间分配请求：每个provider有独立的并发上限和每分钟token预算，
+    按观测到的延迟和错误率选择provider；连续失败达到阈值时熔断一段时间，冷却后先放行一个探测请求。
+    用法: provider = await router.acquire(...)，请求结束后router.release(provider, ...)"""
+
+    def __init__(self, model_configs: Dict[str, dict], names: List[str], default_concurrent: int,
+                 failure_threshold: int = 5, cooldown: float = 60, pinned_names: List[str] = ()):
+        """names为默认参与分配的provider；pinned_names中的provider只在acquire(only=...)指定时使用"""
+        if not names:
+            raise ValueError("至少需要配置一个LLM provider")
+        self.providers = {}
+        self.default_names = list(names)
+        for name in list(names) + [n for n in pinned_names if n not in names]:
+            if name not in model_configs:
+                raise ValueError(f"未找到模型配置: {name}")
+            config = model_configs[name]
+            self.providers[name] = ProviderState(
+                name, config,
+                config.get("max_concurrent", default_concurrent),
+                config.get("tokens_per_minute", 0)
+            )
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.condition = asyncio.Condition()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.default_names)
+
+    def pick(self, estimated_tokens: int, avoid=(), only: str = None):
+        now = time.monotonic()
+        if only is not None:
+            candidates = [self.providers[only]]
+        else:
+            candidates = [self.providers[name] for name in self.default_names]
+            # 重试时优先换一个provider，其他provider都不可用时才回到失败过的provider
+            preferred = [p for p in candidates if p.name not in avoid]
+            if any(p.available(now, estimated_tokens) for p in preferred):
+                candidates = preferred
+        available = [p for p in candidates if p.available(now, estimated_tokens)]
+        if not available:
+            return None
+        return min(available, key=lambda p: p.score())
+
+    async def acquire(self, estimated_tokens: int = 0, avoid=(), only: str = None) -> ProviderState:
+        """等待并占用一个可用的provider；only指定只使用某个provider"""
+        if only is not None and only not in self.providers:
+            raise ValueError(f"未配置的LLM provider: {only}")
+        async with self.condition:
+            while True:
+                provider = self.pick(estimated_tokens, avoid, only)
+                if provider is not None:
+                    break
+                try:
+                    await asyncio.wait_for(self.condition.wait(), WAIT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            now = time.monotonic()
+            provider.in_flight += 1
+            provider.requests += 1
+            provider.tokens.append((now, estimated_tokens))
+            return provider
+
+    async def release(self, provider: ProviderState, ok: bool, latency: float, estimated_tokens: int = 0, actual_tokens: int = None):
+        """归还provider并记录结果；actual_tokens为实际用量，用于修正预估的token数"""
+        async with self.condition:
+            provider.in_flight -= 1
+            now = time.monotonic()
+            if actual_tokens is not None and actual_tokens != estimated_tokens:
+                provider.tokens.append((now, actual_tokens - estimated_tokens))
+            provider.error_rate = provider.error_rate * (1 - EWMA_ALPHA) + (0.0 if ok else EWMA_ALPHA)
+            if ok:
+                provider.latency = latency if provider.latency is None else provider.latency * (1 - EWMA_ALPHA) + latency * EWMA_ALPHA
+                provider.failures = 0
+                provider.open_until = 0.0
+            else:
+                provider.errors += 1
+                provider.failures += 1
+                # 半开探测失败或连续失败达到阈值时熔断
+                if provider.is_half_open(now) or provider.failures >= self.failure_threshold:
+                    provider.open_until = now + self.cooldown
+            self.condition.notify_all()
+
+    def stats(self) -> List[str]:
+        now = time.monotonic()
+        lines = []
+        for p in self.providers.values():
+            if p.is_open(now):
+                state = f"熔断中({p.open_until - now:.0f}s)"
+            else:
+                state = "半开" if p.is_half_open(now) else "正常"
+            latency = f"{p.latency:.2f}s" if p.latency is not None else "-"
+            lines.append(
+                f"{p.name} ({p.config['id']}): {state}, 请求 {p.requests}, 失败 {p.errors}, "
+                f"延迟 {latency}, 错误率 {p.error_rate * 100:.1f}%, 进行中 {p.in_flight}/{p.max_concurrent}"
+            )
+        return lines
@@ -1,20 +1,72 @@
 import os
 import json
+import time
 import asyncio
 import aiohttp
 from datetime import datetime
+from collections import Counter
 from typing import Dict, List, Set
-from xml.etree import ElementTree
 from config import ( 
     MODEL_CONFIGS,
     CURRENT_MODEL,
+    LLM_PROVIDERS,
     MAX_CONCURRENT,
     MAX_RETRIES,
-    RETRY_DELAY
+    RETRY_DELAY,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_FILE,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_MAX_AGE_DAYS,
+    PREFILTER_ENABLED,
+    PREFILTER_REJECT_SCORE,
+    PREFILTER_EVAL_SAMPLE,
+    EASY_INSTALL_LLM_FALLBACK,
+    STATE_DB_FILE,
+    STATE_MAX_ATTEMPTS,
+    LLM_MAX_CONCURRENT,
+    LLM_FAILURE_THRESHOLD,
+    LLM_CIRCUIT_COOLDOWN,
+    LLM_COMPLETION_TOKEN_ESTIMATE,
+    TRIAGE_ENABLED,
+    TRIAGE_MODEL,
+    TRIAGE_CONFIDENCE_THRESHOLD,
+    TRIAGE_README_TOKENS,
+    TRIAGE_BATCH_SIZE,
+    TRIAGE_BATCH_WAIT,
+    TRIAGE_BATCH_README_TOKENS,
+    BATCH_MODE,
+    BATCH_MODEL,
+    LLM_STREAM,
+    LLM_CONNECT_TIMEOUT,
+    LLM_IDLE_TIMEOUT,
+    LLM_OUTPUT_FORMAT
 )
 from enum import Enum
 import sys
 import traceback
+from jsonl_writer import WriterPool
+from worker_pool import run_worker_pool
+from readme_store import ReadmeStore
+from llm_cache import LLMCache
+from llm_metrics import LLMMetrics
+from llm_router import LLMRouter
+from triage import (
+    build_triage_prompt, build_batch_triage_prompt, parse_triage_response, parse_triage_batch,
+    should_escalate, TriageStats
+)
+from micro_batcher import MicroBatcher
+from structured_output import (
+    response_format, parse_structured, validate_analysis, validate_readme, validate_easy_install
+)
+from sse_stream import read_chat_stream, estimate_usage
+from batch_jobs import make_custom_id, build_batch_request, load_batch_results, response_content
+from easy_install_rules import evaluate_easy_install, check_structure
+from readme_reducer import condense_readme, estimate_tokens, DEFAULT_TOKEN_BUDGET
+from mcp_prefilter import score_repo, is_clear_negative, PrefilterStats
+from state_store import (
+    PipelineState, PendingMarks, row_finished,
+    STAGE_ANALYZE, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED
+)
 
 # 配置
 INPUT_FILE = "mcp_full_repos.jsonl"
@@ -22,8 +74,40 @@ OUTPUT_FILE = "mcp_analysis_results.json"
 
 # 添加新的常量定义
 RESULTS_DIR = "results"
-PROCESSED_URLS_FILE = f"{RESULTS_DIR}/processed_urls.txt"
 LOG_FILE = f"{RESULTS_DIR}/analysis.log"
+LLM_METRICS_FILE = f"{RESULTS_DIR}/llm_metrics.jsonl"  # 每次LLM调用的耗时/token/费用记录
+BATCH_REQUESTS_FILE = f"{RESULTS_DIR}/batch_requests.jsonl"  # 批量模式写出的请求(OpenAI Batch格式)
+BATCH_RESULTS_FILE = f"{RESULTS_DIR}/batch_results.jsonl"    # 批量接口返回的结果文件
+BATCH_PENDING_FILE = f"{RESULTS_DIR}/batch_pending.jsonl"    # 主要分析已返回、等待第二轮结果的仓库
+README_STORE_DIR = "readme_store"  # 第二步保存README内容的存储目录
+
+readme_store = ReadmeStore(README_STORE_DIR)
+llm_cache = None  # 在main中按LLM_CACHE_ENABLED创建
+
+# 发送给LLM的请求参数(除model和messages外)，同时作为缓存键的一部分
+LLM_REQUEST_PARAMS = {}
+
+prefilter_stats = PrefilterStats()
+
+# 处理状态库：是否已分析通过主键查询，results下的JSONL文件只作为导出(在main中打开)
+state = None
+pending_marks = None
+RESULT_TYPES = ["server", "tool", "index", "client", "other", "non_mcp", "error"]
+
+# 所有结果文件的缓冲写入者，每个文件只有一个写入者
+writers = WriterPool()
+
+# LLM调用统计
+llm_metrics = LLMMetrics(writers.get(LLM_METRICS_FILE))
+
+# 在多个provider之间分配LLM请求(每个provider独立的并发上限和token预算，失败时熔断并切换)，
+# 未配置LLM_PROVIDERS时只使用CURRENT_MODEL
+llm_router = LLMRouter(
+    MODEL_CONFIGS, LLM_PROVIDERS or [CURRENT_MODEL], LLM_MAX_CONCURRENT,
+    failure_threshold=LLM_FAILURE_THRESHOLD, cooldown=LLM_CIRCUIT_COOLDOWN,
+    pinned_names=[TRIAGE_MODEL] if TRIAGE_ENABLED else []
+)
+triage_stats = TriageStats()
 
 class Color(Enum):
     RED = '\033[91m'
@@ -51,9 +135,41 @@ async def log(message, level="INFO", write_to_file=True):
         with open(LOG_FILE, "a", encoding="utf-8") as f:
             f.write(log_message + "\n")
 
-def load_and_deduplicate_repos() -> List[Dict]:
-    """加载并去重仓库数据，过滤掉无效数据"""
-    repos = []
+def import_legacy_results():
+    """状态库中还没有分析记录时，从旧版本的结果文件导入已处理的仓库"""
+    if state.has_stage(STAGE_ANALYZE):
+        return 0
+    rows = []
+    for result_type in RESULT_TYPES:
+        filename = f"{RESULTS_DIR}/mcp_{result_type}.jsonl"
+        if not os.path.exists(filename):
+            continue
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line.strip())
+                    analysis = result.get("analysis") or {}
+                    if result_type == "error":
+                        status = STATUS_FAILED
+                    elif analysis.get("prefiltered"):
+                        status = STATUS_SKIPPED
+                    else:
+                        status = STATUS_DONE
+                    rows.append({
+                        "full_name": result["repo_name"],
+                        "stage": STAGE_ANALYZE,
+                        "status": status,
+                        "attempts": 1 if status == STATUS_FAILED else 0,
+                        "result_type": result_type,
+                        "error": result.get("error")
+                    })
+                except (json.JSONDecodeError, KeyError, AttributeError):
+                    continue
+    return state.import_rows(rows)
+
+def load_and_deduplicate_repos():
+    """逐行读取并去重仓库数据，过滤掉无效数据(生成器，读取完毕后输出统计信息)"""
+    valid_count = 0
     seen_urls: Set[str] = set()
     skipped_count = {
         "no_readme": 0,
@@ -61,18 +177,9 @@ def load_and_deduplicate_repos() -> List[Dict]:
         "processed": 0
     }
     
-    # 获取所有已处理的仓库
-    processed_repos = set()
-    for result_type in ["server", "tool", "index", "client", "other", "non_mcp", "error"]:
-        filename = f"{RESULTS_DIR}/mcp_{result_type}.jsonl"
-        if os.path.exists(filename):
-            with open(filename, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        result = json.loads(line.strip())
-                        processed_repos.add(result["repo_name"])
-                    except (json.JSONDecodeError, KeyError):
-                        continue
+    imported = import_legacy_results()
+    if imported:
+        print(f"已从旧结果文件导入 {imported} 条处理记录到状态库")
     
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
         for line in f:
@@ -80,9 +187,18 @@ def load_and_deduplicate_repos() -> List[Dict]:
                 repo = json.loads(line.strip())
                 url = repo["html_url"]
                 
-                # 检查是否已经处理过
-                if repo["full_name"] in processed_repos:
+                # 检查是否已经处理过(状态库主键查询)
+                row = state.get(repo["full_name"], STAGE_ANALYZE)
+                if row is not None and row_finished(row, STATE_MAX_ATTEMPTS):
                     skipped_count["processed"] += 1
+                    # 已由LLM标注过的仓库用于评估预筛选的准确率，只抽取前PREFILTER_EVAL_SAMPLE个，
+                    # 避免每次启动都读取全部已处理仓库的README
+                    if (PREFILTER_ENABLED and prefilter_stats.labelled < PREFILTER_EVAL_SAMPLE
+                            and row["status"] == STATUS_DONE and row["result_type"] != "error"):
+                        score, signals = score_repo(repo, load_readme_content(repo))
+                        prefilter_stats.record_labelled(
+                            is_clear_negative(score, signals, PREFILTER_REJECT_SCORE), row["result_type"] != "non_mcp"
+                        )
                     continue
                 
                 # 检查是否重复
@@ -90,48 +206,55 @@ def load_and_deduplicate_repos() -> List[Dict]:
                     skipped_count["duplicate"] += 1
                     continue
                 
-                # 检查是否有README内容
+                # 检查是否有README内容(旧格式内联content，新格式只有sha引用，内容在分析时再读取)
                 readme = repo.get("readme", {})
-                if not readme or not readme.get("content"):
+                if not readme or not (readme.get("content") or readme_store.has(readme.get("sha"))):
                     skipped_count["no_readme"] += 1
                     continue
                 
-                # 通过所有检查，添加到结果列表
+                # 通过所有检查，交给分析worker
                 seen_urls.add(url)
-                repos.append(repo)
+                valid_count += 1
+                yield repo
                 
             except json.JSONDecodeError:
                 continue
     
     # 使用同步方式输出统计信息
     print(f"\n仓库加载统计:")
-    print(f"- 有效仓库数量: {len(repos)}")
+    print(f"- 有效仓库数量: {valid_count}")
     print(f"- 重复仓库数量: {skipped_count['duplicate']}")
     print(f"- 无README仓库数量: {skipped_count['no_readme']}")
     print(f"- 已处理仓库数量: {skipped_count['processed']}")
+    if PREFILTER_ENABLED and PREFILTER_EVAL_SAMPLE:
+        print(f"- {prefilter_stats.precision_summary()}")
     print() # 添加空行使输出更清晰
-    
-    return repos
 
-def get_processed_urls() -> Set[str]:
-    """获取已处理过的URL列表"""
-    if not os.path.exists(PROCESSED_URLS_FILE):
-        return set()
-    with open(PROCESSED_URLS_FILE, "r", encoding="utf-8") as f:
-        return set(line.strip() for line in f)
+def load_readme_content(repo: Dict) -> str:
+    """读取仓库的README内容：旧格式直接内联，新格式按sha从readme_store读取"""
+    readme = repo.get("readme") or {}
+    if readme.get("content"):
+        return readme["content"]
+    return readme_store.get(readme.get("sha")) or ""
 
-def mark_url_as_processed(url: str):
-    """标记URL为已处理"""
-    os.makedirs(os.path.dirname(PROCESSED_URLS_FILE), exist_ok=True)
-    with open(PROCESSED_URLS_FILE, "a", encoding="utf-8") as f:
-        f.write(url + "\n")
+def mark_repo_processed(repo: Dict, status: str, result_type: str, error: str = None):
+    """记录仓库的分析状态，在结果导出落盘后随checkpoint一起写入状态库"""
+    pending_marks.add(
+        repo["full_name"], STAGE_ANALYZE, status,
+        content_hash=(repo.get("readme") or {}).get("sha"),
+        version=repo.get("readme_source_version") or repo.get("pushed_at"),
+        result_type=result_type, error=error
+    )
+
+async def checkpoint():
+    """先把缓冲的结果导出落盘，再写入对应的状态"""
+    await writers.checkpoint_all()
+    pending_marks.flush()
 
 async def save_result_to_jsonl(result: Dict, result_type: str):
     """保存单个结果到对应的JSONL文件"""
     filename = f"{RESULTS_DIR}/mcp_{result_type}.jsonl"
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    with open(filename, "a", encoding="utf-8") as f:
-        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    writers.get(filename).write(result)
     await log(f"已保存结果到 {filename}")
 
 async def validate_server_command(command_str: str) -> bool:
@@ -141,23 +264,11 @@ async def validate_server_command(command_str: str) -> bool:
         command_str = command_str.strip()
         # 解析JSON
         command_json = json.loads(command_str)
-        # 验证基本结构
-        if not isinstance(command_json, dict):
-            return False
-        if "mcpServers" not in command_json:
-            return False
-        if not isinstance(command_json["mcpServers"], dict):
+        # 验证基本结构和每个服务器配置
+        error = check_structure(command_json)
+        if error is not None:
+            await log(f"server_command结构无效: {error}", level="WARN")
             return False
-        # 验证每个服务器配置
-        for server_name, server_config in command_json["mcpServers"].items():
-            if not isinstance(server_config, dict):
-                return False
-            if "command" not in server_config:
-                return False
-            if "args" in server_config and not isinstance(server_config["args"], list):
-                return False
-            if "env" in server_config and not isinstance(server_config["env"], dict):
-                return False
         return True
     except json.JSONDecodeError as e:
         await log(f"server_command JSON解析失败: {str(e)}", level="ERROR")
@@ -166,209 +277,183 @@ async def validate_server_command(command_str: str) -> bool:
         await log(f"server_command验证时发生错误: {str(e)}", level="ERROR")
         return False
 
-async def xml_to_json(xml_str: str) -> Dict:
-    """将XML分析结果转换为JSON格式"""
-    try:
-        # 清理和验证XML字符串
-        xml_str = xml_str.strip()
-        
-        # 处理可能的XML转义字符
-        xml_str = xml_str.replace('&nbsp;', ' ')
-        xml_str = xml_str.replace('&amp;', '&')
-        xml_str = xml_str.replace('&lt;', '<')
-        xml_str = xml_str.replace('&gt;', '>')
-        
-        if not xml_str.startswith('<mcp_response'):
-            # 尝试提取XML部分
-            start = xml_str.find('<mcp_response')
-            end = xml_str.rfind('</mcp_response>') + len('</mcp_response>')
-            if start >= 0 and end > start:
-                xml_str = xml_str[start:end]
-            else:
-                # 如果无法找到有效的XML，返回错误结果
-                await log("无法找到有效的mcp_response标签，返回错误结果", level="ERROR")
-                return {
-                    "is_mcp_related": False,
-                    "reason": "XML解析失败：无法找到有效的mcp_response标签",
-                    "score": 0
-                }
-        
-        try:
-            # 尝试解析XML
-            root = ElementTree.fromstring(xml_str)
-        except ElementTree.ParseError as e:
-            # XML解析失败时的错误处理
-            error_msg = f"""XML解析错误: {str(e)}
-原始XML内容:
-{xml_str}
-错误位置: {e.position}"""
-            await log(error_msg, level="ERROR")
-            return {
-                "is_mcp_related": False,
-                "reason": f"XML解析失败：{str(e)}",
-                "score": 0
-            }
-        
-        # 基本字段
-        is_mcp_related = root.find("is_mcp_related")
-        if is_mcp_related is None:
-            raise ValueError("缺少必需的is_mcp_related字段")
-        result["is_mcp_related"] = is_mcp_related.text.lower() == "true"
-        
-        if not result["is_mcp_related"]:
-            reason = root.find("reason")
-            result["reason"] = reason.text if reason is not None else "未提供原因"
-            # 添加评分解析
-            score = root.find("score")
-            if score is not None:
-                try:
-                    result["score"] = int(score.text.split(',')[0].strip())
-                except (ValueError, TypeError):
-                    await log("评分解析失败，设置为0", level="ERROR")
-                    result["score"] = 0
-            else:
-                result["score"] = 0
-            return result
-            
-        # MCP相关字段
-        result["is_mcp_server"] = root.find("is_mcp_server").text.lower() == "true"
-        result["repo_type"] = root.find("repo_type").text
-        result["description"] = root.find("description").text
-        
-        if not result["is_mcp_server"]:
-            result["reason"] = root.find("reason").text
-            # 添加评分解析
-            score = root.find("score")
-            if score is not None:
-                try:
-                    result["score"] = int(score.text.split(',')[0].strip())
-                except (ValueError, TypeError):
-                    await log("评分解析失败，设置为0", level="ERROR")
-                    result["score"] = 0
-            else:
-                result["score"] = 0
-            return result
-        
-        # MCP服务器特有字段
-        server_fields = [
-            "name", "author", "url", "readme", "github_username",
-            "server_name", "is_command_guessed", "server_command",
-            "is_stateless", "stateless_reason", "deployment_mode",
-            "deployment_reason", "is_easy_install"  # 添加is_easy_install到服务器字段列表
-        ]
-        
-        for field in server_fields:
-            elem = root.find(field)
-            if elem is not None:
-                if field == "server_command":
-                    # 解析JSON字符串
-                    try:
-                        result[field] = json.loads(elem.text)
-                    except json.JSONDecodeError:
-                        result[field] = elem.text  # 保留原始文本
-                elif field in ["is_command_guessed", "is_stateless", "is_easy_install"]:  # 添加is_easy_install到布尔字段列表
-                    result[field] = elem.text.lower() == "true"
-                else:
-                    result[field] = elem.text
-        
-        # 处理参数列表
-        params = root.find("params")
-        if params is not None:
-            result["params"] = [param.text for param in params.findall("param")]
-        
-        # 处理标签
-        tags = root.find("tags")
-        if tags is not None:
-            result["tags"] = [tag.text for tag in tags.findall("tag")]
-        
-        # 添加评分解析
-        score = root.find("score")
-        if score is not None:
-            try:
-                result["score"] = int(score.text.split(',')[0].strip())
-            except (ValueError, TypeError):
-                await log("评分解析失败，设置为0", level="ERROR")
-                result["score"] = 0
-        else:
-            result["score"] = 0
-        
-        return result
+async def parse_analysis_response(text: str) -> Dict:
+    """解析主要分析的响应(JSON或XML格式)并校验，响应不完整或缺少必需字段时抛出ValueError"""
+    data = parse_structured(text, "mcp_response")
+    if data is None:
+        await log(f"无法找到完整的mcp_response，原始响应:\n{text}", level="ERROR")
+        raise ValueError("分析响应不完整：无法找到有效的mcp_response")
+    return validate_analysis(data)
 
-    except Exception as e:
-        error_msg = f"""XML处理错误: {str(e)}
-原始XML内容:
-{xml_str}
-堆栈跟踪:
-{traceback.format_exc()}"""
-        await log(error_msg, level="ERROR")
-        return {
-            "is_mcp_related": False,
-            "reason": f"XML处理错误：{str(e)}",
-            "score": 0
-        }
+def output_options(name: str) -> Dict:
+    """call_llm_api的输出格式参数：JSON模式按schema名称请求结构化输出，XML模式等待对应的结束标签"""
+    if LLM_OUTPUT_FORMAT == "json":
+        return {"schema": name}
+    return {"expect_tag": f"</{name}>"}
 
-async def call_llm_api(session, prompt: str, retries: int = 0) -> Dict:
-    """调用LLM API并支持重试"""
-    try:
-        # 获取当前模型配置
-        if CURRENT_MODEL not in MODEL_CONFIGS:
-            raise ValueError(f"未找到模型配置: {CURRENT_MODEL}")
-        
-        model_config = MODEL_CONFIGS[CURRENT_MODEL]
-        await log(f"使用模型: {CURRENT_MODEL} ({model_config['id']})")
-        
-        headers = {
-            "Authorization": f"Bearer {model_config['api_key']}",
-            "Content-Type": "application/json"
-        }
-        
-        # 添加超时设置
+def request_params(model_config: dict, schema: str = None) -> Dict:
+    """发送给LLM的请求参数(同时是缓存键的一部分)，JSON模式下按provider支持的类型加上response_format"""
+    params = dict(LLM_REQUEST_PARAMS)
+    if schema is not None:
+        fmt = response_format(model_config.get("response_format"), schema)
+        if fmt is not None:
+            params["response_format"] = fmt
+    return params
+
+def cached_providers(model: str = None) -> List[str]:
+    return [model] if model is not None else llm_router.names
+
+def discard_cached_response(prompt: str, model: str = None, schema: str = None):
+    """缓存的响应无法使用(如解析失败)时删除，下一次重试会真正请求LLM"""
+    if llm_cache is not None:
+        for name in cached_providers(model):
+            llm_cache.discard(MODEL_CONFIGS[name], prompt, request_params(MODEL_CONFIGS[name], schema))
+
+async def call_llm_api(session, prompt: str, expect_tag: str = None, stage: str = "analysis", model: str = None,
+                       schema: str = None) -> Dict:
+    """调用LLM API并支持重试，expect_tag为响应中必须出现的结束标签，只有包含该标签的完整响应才会被缓存；
+    schema为JSON输出的响应名称(见structured_output.SCHEMAS)，只有包含完整JSON对象的响应才会被缓存。
+    stage用于按阶段统计延迟、token用量和费用；请求由llm_router分配给LLM_PROVIDERS中的provider，
+    失败重试时优先换一个provider，model指定时只使用该provider"""
+    if llm_cache is not None:
+        for name in cached_providers(model):
+            cached = llm_cache.get(MODEL_CONFIGS[name], prompt, request_params(MODEL_CONFIGS[name], schema))
+            if cached is not None:
+                await log(f"命中LLM缓存: {name} ({MODEL_CONFIGS[name]['id']})")
+                llm_metrics.record(stage, MODEL_CONFIGS[name], status=200, cached=True)
+                return cached
+    
+    # 流式请求按两次数据之间的空闲时间判断超时，持续输出的长响应不会被中断；非流式请求仍限制总时间
+    if LLM_STREAM:
+        timeout = aiohttp.ClientTimeout(total=None, connect=LLM_CONNECT_TIMEOUT, sock_read=LLM_IDLE_TIMEOUT)
+        stream_params = {"stream": True, "stream_options": {"include_usage": True}}
+    else:
         timeout = aiohttp.ClientTimeout(total=60)  # 60秒超时
-        
-        async with session.post(
-            model_config["url"],
-            headers=headers,
-            json={
-                "model": model_config["id"],
-                "messages": [{"role": "user", "content": prompt}],
-            },
-            timeout=timeout
-        ) as response:
-            if response.status != 200:
-                error_text = await response.text()
-                await log(f"API请求失败: HTTP {response.status}, 响应: {error_text}", level="ERROR")
-                if retries < MAX_RETRIES:
-                    await asyncio.sleep(RETRY_DELAY * (retries + 1))  # 指数退避
-                    return await call_llm_api(session, prompt, retries + 1)
-                raise Exception(f"API调用失败，已重试{MAX_RETRIES}次")
-            
-            response_json = await response.json()
+        stream_params = {}
+    # 预估的token用量，用于provider的每分钟token预算，请求完成后按实际用量修正
+    estimated_tokens = estimate_tokens(prompt) + LLM_COMPLETION_TOKEN_ESTIMATE
+    
+    queue_wait = 0.0
+    network_time = 0.0
+    status = None
+    retries = 0
+    failed_providers = set()
+    while True:
+        queued_at = time.monotonic()
+        # 等待有空闲并发和token预算的provider，等待时间单独统计
+        provider = await llm_router.acquire(estimated_tokens, avoid=failed_providers, only=model)
+        model_config = provider.config
+        started_at = time.monotonic()
+        queue_wait += started_at - queued_at
+        response_json = None
+        ok = False
+        try:
+            await log(f"使用模型: {provider.name} ({model_config['id']})")
+            try:
+                async with session.post(
+                    model_config["url"],
+                    headers={
+                        "Authorization": f"Bearer {model_config['api_key']}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": model_config["id"],
+                        "messages": [{"role": "user", "content": prompt}],
+                        **request_params(model_config, schema),
+                        **stream_params
+                    },
+                    timeout=timeout
+                ) as response:
+                    status = response.status
+                    if response.status != 200:
+                        error_text = await response.text()
+                        # 交给下面的异常处理，按MAX_RETRIES重试
+                        raise Exception(f"API请求失败: {provider.name} HTTP {response.status}, 响应: {error_text}")
+                    if "text/event-stream" in response.headers.get("Content-Type", ""):
+                        # 出现期望的结束标签(或JSON对象结束)后立即停止，不再等待(和支付)之后的输出
+                        response_json = await read_chat_stream(response, expect_tag, stop_at_json_end=schema is not None)
+                        if not response_json["usage"]:
+                            response_json["usage"] = estimate_usage(prompt, response_json["choices"][0]["message"]["content"])
+                    else:
+                        # 服务端不支持流式时返回普通JSON
+                        response_json = await response.json()
+                    
+                    # 验证响应格式
+                    if not isinstance(response_json, dict) or 'choices' not in response_json:
+                        raise ValueError(f"API响应格式错误: {response_json}")
+                        
+                    if not response_json['choices'] or 'message' not in response_json['choices'][0]:
+                        raise ValueError(f"API响应缺少必要字段: {response_json}")
+                    
+                    if not response_json['choices'][0]['message'].get('content'):
+                        raise ValueError(f"API响应内容为空: {response_json}")
+                    ok = True
+            finally:
+                elapsed = time.monotonic() - started_at
+                network_time += elapsed
+                usage = response_json.get("usage") if ok else None
+                actual_tokens = usage.get("total_tokens") if usage else None
+                await llm_router.release(provider, ok, elapsed, estimated_tokens, actual_tokens)
             
-            # 验证响应格式
-            if not isinstance(response_json, dict) or 'choices' not in response_json:
-                raise ValueError(f"API响应格式错误: {response_json}")
+            if ok:
+                if llm_cache is not None:
+                    content = response_json['choices'][0]['message'].get('content') or ''
+                    if schema is not None:
+                        complete = parse_structured(content, schema) is not None
+                    else:
+                        complete = expect_tag is None or expect_tag in content
+                    if complete:
+                        llm_cache.put(model_config, prompt, request_params(model_config, schema), response_json)
                 
-            if not response_json['choices'] or 'message' not in response_json['choices'][0]:
-                raise ValueError(f"API响应缺少必要字段: {response_json}")
+                llm_metrics.record(
+                    stage, model_config, status=status, retries=retries, queue_wait=queue_wait,
+                    network_time=network_time, usage=response_json.get("usage")
+                )
+                return response_json
                 
-            return response_json
-            
-    except asyncio.TimeoutError:
-        await log(f"API请求超时 (重试次数: {retries}/{MAX_RETRIES})", level="ERROR")
-        if retries < MAX_RETRIES:
-            await asyncio.sleep(RETRY_DELAY * (retries + 1))
-            return await call_llm_api(session, prompt, retries + 1)
-        raise
-    except Exception as e:
-        await log(f"API调用出错 (重试次数: {retries}/{MAX_RETRIES}): {str(e)}\n{traceback.format_exc()}", level="ERROR")
-        if retries < MAX_RETRIES:
-            await asyncio.sleep(RETRY_DELAY * (retries + 1))
-            return await call_llm_api(session, prompt, retries + 1)
-        raise
+        except asyncio.TimeoutError:
+            await log(f"API请求超时: {provider.name} (重试次数: {retries}/{MAX_RETRIES})", level="ERROR")
+            if retries >= MAX_RETRIES:
+                llm_metrics.record(stage, model_config, status=status, retries=retries, queue_wait=queue_wait,
+                                   network_time=network_time, error="timeout")
+                raise
+        except Exception as e:
+            await log(f"API调用出错: {provider.name} (重试次数: {retries}/{MAX_RETRIES}): {str(e)}\n{traceback.format_exc()}", level="ERROR")
+            if retries >= MAX_RETRIES:
+                llm_metrics.record(stage, model_config, status=status, retries=retries, queue_wait=queue_wait,
+                                   network_time=network_time, error=str(e))
+                raise
+        
+        # 下一次重试优先使用其他provider
+        failed_providers.add(provider.name)
+        retries += 1
+        await asyncio.sleep(RETRY_DELAY * retries)  # 指数退避
 
-async def generate_readme(session, repo: Dict) -> str:
-    """生成详细的README文档"""
-    prompt = f"""请根据以下仓库信息生成一篇详细的文档介绍：
+# 各提示词的返回格式模板(XML / JSON)
+README_XML_FORMAT = """<mcp_readme_response>
+    <content><![CDATA[
+在这里生成详细的Markdown格式文档
+    ]]></content>
+</mcp_readme_response>"""
+README_JSON_FORMAT = """{"content": "在这里生成详细的Markdown格式文档"}"""
+
+EASY_INSTALL_XML_FORMAT = """<easy_install_response>
+    <is_easy_install>true/false</is_easy_install>
+    <reason>详细解释为什么容易/不容易安装</reason>
+</easy_install_response>"""
+EASY_INSTALL_JSON_FORMAT = """{"is_easy_install": true/false, "reason": "详细解释为什么容易/不容易安装"}"""
+
+def output_format_section(xml_template: str, json_template: str) -> str:
+    """提示词末尾的返回格式说明，按LLM_OUTPUT_FORMAT选择JSON或XML模板"""
+    if LLM_OUTPUT_FORMAT == "json":
+        return f"""请只返回一个JSON对象，不要添加任何其他内容，格式如下：
+{json_template}"""
+    return f"""请严格按照以下XML格式返回，不要添加任何其他内容：
+{xml_template}"""
+
+def build_readme_prompt(repo: Dict) -> str:
+    """生成README文档的提示词"""
+    return f"""请根据以下仓库信息生成一篇详细的文档介绍：
 
 仓库信息:
 - 仓库名称: {repo['name']}
@@ -385,52 +470,53 @@ async def generate_readme(session, repo: Dict) -> str:
 5. 使用严格的Markdown格式
 6. 务必使用中文
 
-请使用以下XML格式返回：
-<mcp_readme_response>
-    <content><![CDATA[
-在这里生成详细的Markdown格式文档
-    ]]></content>
-</mcp_readme_response>
+{output_format_section(README_XML_FORMAT, README_JSON_FORMAT)}
 """
+
+async def parse_readme_response(text: str):
+    """从LLM响应中解析生成的README，失败时返回None"""
+    data = parse_structured(text, "mcp_readme_response")
+    if data is None:
+        await log("无法找到完整的mcp_readme_response", level="ERROR")
+        return None
+    readme_text = validate_readme(data)
+    if readme_text is None:
+        await log("README内容为空", level="ERROR")
+    return readme_text
+
+async def generate_readme(session, repo: Dict) -> str:
+    """生成详细的README文档"""
+    prompt = build_readme_prompt(repo)
+    options = output_options("mcp_readme_response")
     
     try:
-        response = await call_llm_api(session, prompt)
-        xml_result = response["choices"][0]["message"]["content"]
-        
-        # 清理和验证XML字符串
-        xml_result = xml_result.strip()
-        if not xml_result.startswith('<mcp_readme_response'):
-            # 尝试提取XML部分
-            start = xml_result.find('<mcp_readme_response')
-            end = xml_result.rfind('</mcp_readme_response>') + len('</mcp_readme_response>')
-            if start >= 0 and end > start:
-                xml_result = xml_result[start:end]
-            else:
-                await log("无法找到有效的mcp_readme_response标签", level="ERROR")
-                return None
-
-        try:
-            root = ElementTree.fromstring(xml_result)
-            content = root.find('content')
-            if content is not None:
-                readme_text = content.text.strip()
-                if readme_text:
-                    return readme_text
-                
-            await log("README内容为空", level="ERROR")
-            return None
-            
-        except ElementTree.ParseError as e:
-            await log(f"README XML解析失败: {str(e)}\n原始内容: {xml_result}", level="ERROR")
-            return None
+        response = await call_llm_api(session, prompt, stage="readme", **options)
+        readme_text = await parse_readme_response(response["choices"][0]["message"]["content"])
+        if readme_text is None:
+            # 缓存的响应无法使用，下次重新请求
+            discard_cached_response(prompt, schema=options.get("schema"))
+        return readme_text
             
     except Exception as e:
         await log(f"生成README失败: {str(e)}", level="ERROR")
         return None
 
-async def analyze_easy_install(session, server_command: Dict) -> bool:
-    """分析服务器命令是否容易安装"""
-    prompt = f"""请分析以下MCP服务器的启动命令，判断它是否容易安装和部署。
+async def analyze_easy_install(session, server_command: Dict):
+    """分析服务器命令是否容易安装，返回(is_easy_install, 原因)。
+    先按确定性规则判断，只有规则无法确定且开启了EASY_INSTALL_LLM_FALLBACK时才调用LLM"""
+    is_easy_install, reason = evaluate_easy_install(server_command)
+    if is_easy_install is not None:
+        await log(f"Easy install 规则判断结果: {is_easy_install}, 原因: {reason}")
+        return is_easy_install, reason
+    if not EASY_INSTALL_LLM_FALLBACK:
+        await log(f"Easy install 规则无法确定({reason})，按不容易安装处理", level="WARN")
+        return False, reason
+    await log(f"Easy install 规则无法确定({reason})，交给LLM判断")
+    return await analyze_easy_install_llm(session, server_command)
+
+def build_easy_install_prompt(server_command: Dict) -> str:
+    """判断服务器命令是否容易安装的提示词"""
+    return f"""请分析以下MCP服务器的启动命令，判断它是否容易安装和部署。
 
 服务器命令配置:
 {json.dumps(server_command, indent=2, ensure_ascii=False)}
@@ -442,105 +528,110 @@ async def analyze_easy_install(session, server_command: Dict) -> bool:
 4. 如果运行参数args或环境变量env中需要用户自行指定本地文件path，就为false
 5. 只有使用标准包管理器或容器化部署，且无需额外本地文件配置的才为true
 
-请严格按照以下XML格式返回，不要添加任何其他内容：
-<easy_install_response>
-    <is_easy_install>true/false</is_easy_install>
-    <reason>详细解释为什么容易/不容易安装</reason>
-</easy_install_response>
+{output_format_section(EASY_INSTALL_XML_FORMAT, EASY_INSTALL_JSON_FORMAT)}
 """
 
+async def parse_easy_install_response(text: str):
+    """解析easy install响应，返回(is_easy_install, 原因)；响应无效时is_easy_install为None"""
+    data = parse_structured(text, "easy_install_response")
+    if data is None:
+        await log(f"无法找到完整的easy_install_response，原始响应：\n{text}", level="ERROR")
+        return None, "LLM响应格式无效"
+    is_easy_install, reason = validate_easy_install(data)
+    if is_easy_install is None:
+        await log(f"easy install响应缺少is_easy_install，原始响应：\n{text}", level="ERROR")
+    else:
+        await log(f"Easy install 分析结果: {is_easy_install}, 原因: {reason}")
+    return is_easy_install, reason
+
+async def analyze_easy_install_llm(session, server_command: Dict):
+    """用LLM分析服务器命令是否容易安装，返回(is_easy_install, 原因)"""
+    prompt = build_easy_install_prompt(server_command)
+    options = output_options("easy_install_response")
+
     try:
-        response = await call_llm_api(session, prompt)
-        xml_result = response["choices"][0]["message"]["content"]
-        
-        # 清理和验证XML字符串
-        xml_result = xml_result.strip()
-        if not xml_result.startswith('<easy_install_response'):
-            # 尝试提取XML部分
-            start = xml_result.find('<easy_install_response')
-            end = xml_result.rfind('</easy_install_response>') + len('</easy_install_response>')
-            if start >= 0 and end > start:
-                xml_result = xml_result[start:end]
-            else:
-                await log(f"无法找到有效的easy_install_response标签，原始响应：\n{xml_result}", level="ERROR")
-                return False
-
-        # 确保XML格式正确
-        xml_result = xml_result.replace('&', '&amp;')  # 转义特殊字符
-        
-        try:
-            root = ElementTree.fromstring(xml_result)
-            is_easy_install = root.find('is_easy_install')
-            reason = root.find('reason')
-            
-            if is_easy_install is not None:
-                result = is_easy_install.text.lower() == 'true'
-                await log(f"Easy install 分析结果: {result}, 原因: {reason.text if reason is not None else '未提供'}")
-                return result
-            else:
-                await log(f"无法找到is_easy_install标签，XML内容：\n{xml_result}", level="ERROR")
-                return False
-                
-        except ElementTree.ParseError as e:
-            error_msg = f"""Easy install XML解析失败: {str(e)}
-原始XML内容:
-{xml_result}
-错误位置: {getattr(e, 'position', 'unknown')}"""
-            await log(error_msg, level="ERROR")
-            return False
+        response = await call_llm_api(session, prompt, stage="easy_install", **options)
+        is_easy_install, reason = await parse_easy_install_response(response["choices"][0]["message"]["content"])
+        if is_easy_install is None:
+            discard_cached_response(prompt, schema=options.get("schema"))
+            return False, reason
+        return is_easy_install, reason
             
     except Exception as e:
         await log(f"分析easy install失败: {str(e)}\n{traceback.format_exc()}", level="ERROR")
-        return False
+        return False, f"分析失败: {str(e)}"
 
-async def analyze_repo(session, repo: Dict, semaphore: asyncio.Semaphore):
-    """分析单个仓库"""
-    async with semaphore:
-        try:
-            await log(f"开始分析仓库: {repo['full_name']}")
-            
-            if repo['html_url'] in get_processed_urls():
-                await log(f"仓库 {repo['full_name']} 已处理过，跳过")
-                return None
-
-            # 添加重试计数器
-            retry_count = 0
-            max_retries = 3
-            
-            while retry_count < max_retries:
-                try:
-                    # 首先生成README
-                    readme_content = await generate_readme(session, repo)
-                    
-                    # 主要分析
-                    prompt = f"""请详细分析这个GitHub仓库是否与MCP（模型上下文协议，Model Context Protocol）相关，并确定它的具体类型。
+async def skipped_step():
+    """依赖条件不满足、不需要执行的步骤"""
+    return None
 
-详细仓库信息:
-- 仓库名称: {repo['name']}
-- 仓库作者: {repo['owner']}
-- 作者用户名: {repo['owner']}
-- 仓库URL: {repo['html_url']}
-- 仓库描述: {repo['description']}
-- 创建时间: {repo['created_at']}
-- 最后更新: {repo['updated_at']}
-- Stars数量: {repo['stargazers_count']}
-- Forks数量: {repo['forks_count']}
-- 主要语言: {repo.get('language', '未知')}
+def analysis_output_format(repo: Dict) -> str:
+    """主要分析提示词中三种情况的返回格式，按LLM_OUTPUT_FORMAT选择JSON或XML"""
+    if LLM_OUTPUT_FORMAT == "json":
+        return f"""请只返回一个JSON对象，不要添加任何其他内容。
 
-仓库README内容:
-{repo.get('readme', {}).get('content', '')}
+如果仓库与MCP无关，请返回:
+{{
+  "is_mcp_related": false,
+  "reason": "解释为什么这个仓库与MCP无关",
+  "score": 0-100的整数，通过仓库内容分析仓库质量给仓库打分，分数越高说明质量越好
+}}
 
-MCP相关仓库可能属于以下几种类型:
-1. MCP服务器(Server): 提供具体功能的MCP服务器实现，可由大语言模型直接调用的服务
-2. MCP导航/索引(Index): 收集、列出或汇总各种MCP服务器的资源列表（如awesome-mcp）
-3. MCP开发工具(Tool): 用于开发MCP服务器的工具、框架、SDK或库
-4. MCP客户端(Client): 用于连接MCP服务器的客户端实现
-5. 其他MCP相关(Other): 与MCP相关但不属于上述类别的仓库
-6. 非MCP相关(NotMCP): 与MCP无关的仓库
+如果仓库与MCP相关但不是MCP服务器，请返回:
+{{
+  "is_mcp_related": true,
+  "is_mcp_server": false,
+  "reason": "详细解释为什么这不是MCP服务器，而是另一种类型",
+  "repo_type": "Index/Tool/Client/Other 之一",
+  "name": "{repo['name']}",
+  "author": "{repo['owner']}",
+  "description": "60字左右的简洁中文描述，概括此仓库的功能和价值",
+  "url": "{repo['html_url']}",
+  "tags": ["标签1", "标签2", "标签3"],
+  "score": 0-100的整数
+}}
 
-请首先判断这个仓库是否与MCP相关，然后确定它属于哪种具体类型。
+如果仓库是MCP服务器，请返回:
+{{
+  "is_mcp_related": true,
+  "is_mcp_server": true,
+  "repo_type": "Server",
+  "name": "{repo['name']}",
+  "author": "{repo['owner']}",
+  "description": "60字左右的简洁中文描述，概括此MCP服务器的功能和价值",
+  "url": "{repo['html_url']}",
+  "github_username": "{repo['owner']}",
+  "server_name": "@{repo['owner']}/{repo['name']}",
+  "server_command": {{
+    "mcpServers": {{
+      "{repo['owner']}-{repo['name']}": {{
+        "command": "启动命令的主程序 (确保根据仓库资料严谨推测，一般是一个专用的二进制程序)",
+        "args": ["参数1", "参数2"],
+        "env": {{"ENV_VAR_1": "值1"}}
+      }}
+    }}
+  }},
+  "params": ["ENV_VAR_1"],
+  "is_command_guessed": true/false,
+  "is_stateless": true/false,
+  "stateless_reason": "详细解释为什么这是/不是无状态服务",
+  "deployment_mode": "cloud/local/both 之一",
+  "deployment_reason": "详细解释为什么这个MCP服务器更适合云端部署/本地部署/两者都适合",
+  "tags": ["标签1", "标签2"],
+  "score": 0-100的整数
+}}
 
-如果仓库与MCP无关，请返回以下XML格式:
+server_command要求:
+- server_command是JSON对象，不是字符串
+- args是程序启动的命令必要参数，不要含有中文或随机提示内容，务必确保拼接后能正确启动服务，不要添加任何多余参数
+- 忽略资料中任何与sse的host或port指定相关的参数
+- 如果是docker启动，不要通过--env-file指定环境变量文件，而是在args中直接指定需要的环境变量，每个环境变量都需要单独的 -e 参数，如：docker run -i --rm -e ENV_VAR_1 -e ENV_VAR_2 mcp/github
+- 涉及到自定义变量的，args数组中只写变量名，实际的变量值放在env对象中
+- env中是需要用户自定义的KEY、URL等，严格根据仓库资料推测，如果仓库中没有提供就没有，不要自己添加任何多余参数
+- params与env中的参数名称严格一一对应
+- tags数量3~5个，根据实际情况提供，优先使用中文标签
+"""
+    return f"""如果仓库与MCP无关，请返回以下XML格式:
 <mcp_response>
   <is_mcp_related>false</is_mcp_related>
   <reason>解释为什么这个仓库与MCP无关</reason>
@@ -613,6 +704,38 @@ MCP相关仓库可能属于以下几种类型:
   </tags>
   <score>0-100，通过仓库内容分析仓库质量给仓库打分，只需给出分数不要给出任何解释，分数越高说明质量越好</score>
 </mcp_response>
+"""
+
+def build_analysis_prompt(repo: Dict) -> str:
+    """生成主要分析(分类)的提示词"""
+    return f"""请详细分析这个GitHub仓库是否与MCP（模型上下文协议，Model Context Protocol）相关，并确定它的具体类型。
+
+详细仓库信息:
+- 仓库名称: {repo['name']}
+- 仓库作者: {repo['owner']}
+- 作者用户名: {repo['owner']}
+- 仓库URL: {repo['html_url']}
+- 仓库描述: {repo['description']}
+- 创建时间: {repo['created_at']}
+- 最后更新: {repo['updated_at']}
+- Stars数量: {repo['stargazers_count']}
+- Forks数量: {repo['forks_count']}
+- 主要语言: {repo.get('language', '未知')}
+
+仓库README内容:
+{repo.get('readme', {}).get('content', '')}
+
+MCP相关仓库可能属于以下几种类型:
+1. MCP服务器(Server): 提供具体功能的MCP服务器实现，可由大语言模型直接调用的服务
+2. MCP导航/索引(Index): 收集、列出或汇总各种MCP服务器的资源列表（如awesome-mcp）
+3. MCP开发工具(Tool): 用于开发MCP服务器的工具、框架、SDK或库
+4. MCP客户端(Client): 用于连接MCP服务器的客户端实现
+5. 其他MCP相关(Other): 与MCP相关但不属于上述类别的仓库
+6. 非MCP相关(NotMCP): 与MCP无关的仓库
+
+请首先判断这个仓库是否与MCP相关，然后确定它属于哪种具体类型。
+
+{analysis_output_format(repo)}
 请务必仔细阅读仓库资料，确保准确无误，不要遗漏任何重要信息，不要添加任何多余信息，不要给出错误的格式信息
 
 注意事项:
@@ -665,81 +788,259 @@ MCP相关仓库可能属于以下几种类型:
 
 """
 
+
+async def prefilter_repo(repo: Dict):
+    """本地预筛选：明确与MCP无关的仓库直接保存为non_mcp结果并返回，否则返回None"""
+    score, signals = score_repo(repo, repo["readme"]["content"])
+    rejected = is_clear_negative(score, signals, PREFILTER_REJECT_SCORE)
+    prefilter_stats.record(rejected)
+    if not rejected:
+        return None
+
+    matched = ", ".join(signals) if signals else "无"
+    result = {
+        "repo_name": repo["full_name"],
+        "analysis_time": datetime.now().isoformat(),
+        "analysis": {
+            "is_mcp_related": False,
+            "reason": f"本地预筛选：未发现足够的MCP特征(得分 {score}，命中特征: {matched})",
+            "score": 0,
+            "prefiltered": True,
+            "prefilter_score": score,
+            "prefilter_signals": signals
+        }
+    }
+    await save_result_to_jsonl(result, "non_mcp")
+    mark_repo_processed(repo, STATUS_SKIPPED, "non_mcp")
+    await log(f"仓库 {repo['full_name']} 未通过预筛选(得分 {score})，跳过LLM分析")
+    return result
+
+async def triage_repo(session, repo: Dict):
+    """用便宜的模型初筛，返回分类结果；请求失败或响应无法解析时返回None(交给完整分析)"""
+    readme, _ = condense_readme(repo["readme"]["content"], TRIAGE_README_TOKENS)
+    prompt = build_triage_prompt(repo, readme)
+    try:
+        response = await call_llm_api(
+            session, prompt, expect_tag='</triage_response>', stage="triage", model=TRIAGE_MODEL
+        )
+    except Exception as e:
+        await log(f"初筛请求失败: {repo['full_name']}: {str(e)}", level="WARN")
+        return None
+    
+    triage = parse_triage_response(response["choices"][0]["message"].get("content") or "")
+    if triage is None:
+        await log(f"初筛响应无法解析: {repo['full_name']}", level="WARN")
+        discard_cached_response(prompt, TRIAGE_MODEL)
+        return None
+    triage["model"] = MODEL_CONFIGS[TRIAGE_MODEL]["id"]
+    return triage
+
+async def triage_batch(session, repos: List[Dict]) -> List[Dict]:
+    """一个请求初筛一批仓库，结果按full_name对应；批量响应中缺失或格式错误的仓库逐个重新初筛"""
+    if len(repos) == 1:
+        return [await triage_repo(session, repos[0])]
+    
+    items = [(repo, condense_readme(repo["readme"]["content"], TRIAGE_BATCH_README_TOKENS)[0]) for repo in repos]
+    prompt = build_batch_triage_prompt(items)
+    parsed = {}
+    try:
+        response = await call_llm_api(
+            session, prompt, expect_tag='</triage_batch>', stage="triage_batch", model=TRIAGE_MODEL
+        )
+        parsed = parse_triage_batch(response["choices"][0]["message"].get("content") or "")
+    except Exception as e:
+        await log(f"批量初筛请求失败({len(repos)} 个仓库): {str(e)}", level="WARN")
+    
+    missing = [repo for repo in repos if repo["full_name"] not in parsed]
+    if missing:
+        await log(f"批量初筛缺少 {len(missing)}/{len(repos)} 个仓库的结果，逐个重新初筛", level="WARN")
+        discard_cached_response(prompt, TRIAGE_MODEL)
+        retried = await asyncio.gather(*(triage_repo(session, repo) for repo in missing))
+        parsed.update((repo["full_name"], triage) for repo, triage in zip(missing, retried))
+    
+    results = []
+    for repo in repos:
+        triage = parsed.get(repo["full_name"])
+        if triage is not None:
+            triage.setdefault("model", MODEL_CONFIGS[TRIAGE_MODEL]["id"])
+        results.append(triage)
+    return results
+
+async def save_triage_result(repo: Dict, triage: Dict, readme_stats: Dict) -> Dict:
+    """初筛已能确定的仓库(非MCP，或把握足够的非服务器类型)直接保存初筛结果"""
+    if triage["category"] == "NotMCP":
+        analysis = {
+            "is_mcp_related": False,
+            "reason": triage["reason"],
+            "score": triage["score"]
+        }
+        result_type = "non_mcp"
+    else:
+        analysis = {
+            "is_mcp_related": True,
+            "is_mcp_server": False,
+            "repo_type": triage["category"],
+            "description": repo.get("description"),
+            "reason": triage["reason"],
+            "score": triage["score"]
+        }
+        result_type = triage["category"].lower()
+    
+    result = {
+        "repo_name": repo["full_name"],
+        "analysis_time": datetime.now().isoformat(),
+        "readme_stats": readme_stats,
+        "triage": triage,
+        "analysis": analysis
+    }
+    await save_result_to_jsonl(result, result_type)
+    mark_repo_processed(repo, STATUS_DONE, result_type)
+    await log(f"仓库 {repo['full_name']} 初筛为 {triage['category']} (把握 {triage['confidence']})，不做完整分析")
+    return result
+
+async def save_error_result(repo: Dict, e: Exception):
+    """保存分析失败的仓库并标记为失败，需在except块中调用"""
+    error_msg = f"""分析仓库失败: {repo['full_name']}
+错误类型: {type(e).__name__}
+错误信息: {str(e)}
+堆栈跟踪:
+{traceback.format_exc()}"""
+    await log(error_msg, level="ERROR")
+    error_result = {
+        "repo_name": repo["full_name"],
+        "analysis_time": datetime.now().isoformat(),
+        "error": str(e),
+        "error_type": type(e).__name__,
+        "traceback": traceback.format_exc()
+    }
+    await save_result_to_jsonl(error_result, "error")
+    mark_repo_processed(repo, STATUS_FAILED, "error", error=str(e))
+
+async def prepare_repo(repo: Dict, models: List[str] = None):
+    """读取README、预筛选并按models中最小的token预算压缩README(默认为llm_router中的provider)。
+    返回(预筛选结果, README压缩统计)，被预筛选排除时预筛选结果不为None"""
+    # 只有真正要分析的仓库才读取README内容
+    repo["readme"] = dict(repo.get("readme") or {}, content=load_readme_content(repo))
+
+    # 预筛选不占用LLM并发名额
+    if PREFILTER_ENABLED:
+        prefiltered = await prefilter_repo(repo)
+        if prefiltered is not None:
+            return prefiltered, None
+
+    # 去掉徽章/图片/HTML并按章节优先级压缩到模型的token预算内，分析和README生成都使用压缩后的内容
+    # 请求可能被分配给任何一个provider，按其中最小的预算压缩
+    budget = min(MODEL_CONFIGS[name].get("readme_token_budget", DEFAULT_TOKEN_BUDGET) for name in models or llm_router.names)
+    reduced, readme_stats = condense_readme(repo["readme"]["content"], budget)
+    repo["readme"]["content"] = reduced
+    return None, readme_stats
+
+async def assemble_result(repo: Dict, json_result: Dict, readme_content, easy_install,
+                          readme_stats: Dict, triage: Dict = None) -> Dict:
+    """合并主要分析、README生成和easy install的结果，保存并标记为已处理。
+    在线分析和批量导入共用"""
+    is_mcp_server = json_result.get("is_mcp_related") and json_result.get("is_mcp_server")
+    server_command = json_result.get("server_command") if is_mcp_server else None
+
+    # 如果是MCP服务器，记录easy install结果
+    if is_mcp_server:
+        if server_command:
+            json_result["is_easy_install"], json_result["easy_install_reason"] = easy_install
+        else:
+            await log("未找到server_command配置，设置is_easy_install为false", level="WARN")
+            json_result["is_easy_install"] = False
+    
+    # 如果是MCP相关且README生成成功，添加README内容
+    if json_result.get("is_mcp_related") and readme_content is not None:
+        json_result["readme"] = readme_content
+
+    result = {
+        "repo_name": repo["full_name"],
+        "analysis_time": datetime.now().isoformat(),
+        "readme_stats": readme_stats,
+        "analysis": json_result
+    }
+    if triage is not None:
+        result["triage"] = triage
+
+    # 根据类型保存结果
+    if not json_result["is_mcp_related"]:
+        result_type = "non_mcp"
+    else:
+        result_type = json_result["repo_type"].lower()
+    await save_result_to_jsonl(result, result_type)
+
+    # 标记为已处理
+    mark_repo_processed(repo, STATUS_DONE, result_type)
+    await log(f"成功完成仓库 {repo['full_name']} 的分析")
+
+    return result
+
+async def analyze_repo(session, repo: Dict, semaphore: asyncio.Semaphore, triage_batcher: MicroBatcher = None):
+    """分析单个仓库，triage_batcher不为None时初筛请求与其他仓库合并成批"""
+    prefiltered, readme_stats = await prepare_repo(repo)
+    if prefiltered is not None:
+        return prefiltered
+
+    async with semaphore:
+        try:
+            await log(f"开始分析仓库: {repo['full_name']}")
+            
+            if state.is_finished(repo["full_name"], STAGE_ANALYZE, STATE_MAX_ATTEMPTS):
+                await log(f"仓库 {repo['full_name']} 已处理过，跳过")
+                return None
+
+            # 两级分析：便宜模型初筛，只有MCP服务器或不确定的仓库才继续做完整分析
+            triage = None
+            if TRIAGE_ENABLED:
+                if triage_batcher is not None:
+                    triage = await triage_batcher.submit(repo)
+                else:
+                    triage = await triage_repo(session, repo)
+                escalated = should_escalate(triage, TRIAGE_CONFIDENCE_THRESHOLD)
+                triage_stats.record(triage, escalated)
+                if not escalated:
+                    return await save_triage_result(repo, triage, readme_stats)
+
+            # 添加重试计数器
+            retry_count = 0
+            max_retries = 3
+            prompt = None
+            options = output_options("mcp_response")
+            
+            while retry_count < max_retries:
+                try:
+                    # 第一步：主要分析(分类)，后续步骤是否需要执行取决于分类结果
+                    prompt = build_analysis_prompt(repo)
+
                     # 调用API进行主要分析
-                    api_response = await call_llm_api(session, prompt)
-                    xml_result = api_response["choices"][0]["message"]["content"]
-                    
-                    # 验证XML结果
-                    if not xml_result or not xml_result.strip():
-                        raise ValueError("API返回的XML结果为空")
+                    api_response = await call_llm_api(session, prompt, stage="analysis", **options)
+                    response_text = api_response["choices"][0]["message"]["content"]
+                    await log(f"API原始响应:\n{response_text}", level="DEBUG")
                     
-                    await log(f"API原始响应:\n{xml_result}", level="DEBUG")
+                    # 解析并校验(JSON或XML)，只有响应不完整或缺少必需字段时才重新请求
+                    json_result = await parse_analysis_response(response_text)
                     
-                    # 将XML转换为JSON
-                    json_result = await xml_to_json(xml_result)
+                    # 第二步：README生成(仅MCP相关仓库)和easy install分析(仅有启动命令的MCP服务器)互不依赖，并发执行
+                    is_mcp_related = json_result.get("is_mcp_related")
+                    is_mcp_server = is_mcp_related and json_result.get("is_mcp_server")
+                    server_command = json_result.get("server_command") if is_mcp_server else None
                     
-                    if not json_result:
-                        raise ValueError("XML转JSON结果为空")
+                    if server_command:
+                        await log(f"开始分析 easy install，server_command: {json.dumps(server_command, ensure_ascii=False)}")
+                    readme_content, easy_install = await asyncio.gather(
+                        generate_readme(session, repo) if is_mcp_related else skipped_step(),
+                        analyze_easy_install(session, server_command) if server_command else skipped_step()
+                    )
                     
-                    # 如果是MCP服务器，分析easy install
-                    if json_result.get("is_mcp_related") and json_result.get("is_mcp_server"):
-                        server_command = json_result.get("server_command")
-                        if server_command:
-                            await log(f"开始分析 easy install，server_command: {json.dumps(server_command, ensure_ascii=False)}")
-                            is_easy_install = await analyze_easy_install(session, server_command)
-                            
-                            # 直接在json_result中设置结果
-                            json_result["is_easy_install"] = is_easy_install
-                            
-                            # 更新XML以保持一致性
-                            xml_content = xml_result.strip()
-                            insert_pos = xml_content.rfind('</mcp_response>')
-                            if insert_pos > 0:
-                                # 先检查是否已存在is_easy_install标签
-                                if '<is_easy_install>' not in xml_content:
-                                    full_xml = (
-                                        f"{xml_content[:insert_pos]}"
-                                        f"  <is_easy_install>{str(is_easy_install).lower()}</is_easy_install>\n"
-                                        f"{xml_content[insert_pos:]}"
-                                    )
-                                    xml_result = full_xml
-                        else:
-                            await log("未找到server_command配置，设置is_easy_install为false", level="WARN")
-                            json_result["is_easy_install"] = False
-                    
-                    # 如果是MCP相关且README生成成功，添加README内容
-                    if json_result.get("is_mcp_related") and readme_content is not None:
-                        xml_content = xml_result.strip()
-                        insert_pos = xml_content.rfind('</mcp_response>')
-                        if insert_pos > 0:
-                            full_xml = (
-                                f"{xml_content[:insert_pos]}"
-                                f"  <readme><![CDATA[{readme_content}]]></readme>\n"
-                                f"{xml_content[insert_pos:]}"
-                            )
-                            # 重新解析完整的XML
-                            json_result = await xml_to_json(full_xml)
-                    
-                    result = {
-                        "repo_name": repo["full_name"],
-                        "analysis_time": datetime.now().isoformat(),
-                        "analysis": json_result
-                    }
-
-                    # 根据类型保存结果
-                    if not json_result["is_mcp_related"]:
-                        await save_result_to_jsonl(result, "non_mcp")
-                    else:
-                        repo_type = json_result["repo_type"].lower()
-                        await save_result_to_jsonl(result, repo_type)
-
-                    # 标记为已处理
-                    mark_url_as_processed(repo['html_url'])
-                    await log(f"成功完成仓库 {repo['full_name']} 的分析")
-                    
-                    return result
+                    return await assemble_result(
+                        repo, json_result, readme_content, easy_install, readme_stats, triage
+                    )
 
                 except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    # 外层重试时已成功的README生成等调用会命中缓存，只有主分析的响应需要重新请求
+                    if prompt is not None:
+                        discard_cached_response(prompt, schema=options.get("schema"))
                     retry_count += 1
                     if retry_count >= max_retries:
                         raise
@@ -747,63 +1048,218 @@ MCP相关仓库可能属于以下几种类型:
                     await asyncio.sleep(RETRY_DELAY * retry_count)  # 指数退避
                     
         except Exception as e:
-            error_msg = f"""分析仓库失败: {repo['full_name']}
-错误类型: {type(e).__name__}
-错误信息: {str(e)}
-堆栈跟踪:
-{traceback.format_exc()}"""
-            await log(error_msg, level="ERROR")
-            error_result = {
-                "repo_name": repo["full_name"],
-                "analysis_time": datetime.now().isoformat(),
-                "error": str(e),
-                "error_type": type(e).__name__,
-                "traceback": traceback.format_exc()
-            }
-            await save_result_to_jsonl(error_result, "error")
+            await save_error_result(repo, e)
             return None
 
+# 批量请求的阶段 -> 响应名称(决定JSON模式下的response_format)
+BATCH_RESPONSE_NAMES = {
+    "analysis": "mcp_response",
+    "readme": "mcp_readme_response",
+    "easy_install": "easy_install_response"
+}
+
+def load_batch_pending() -> Dict[str, str]:
+    """读取等待第二轮结果的仓库: full_name -> 主要分析的响应文本"""
+    pending = {}
+    if not os.path.exists(BATCH_PENDING_FILE):
+        return pending
+    with open(BATCH_PENDING_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line.strip())
+                pending[record["full_name"]] = record["response"]
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return pending
+
+def save_batch_pending(pending: Dict[str, str]):
+    tmp_path = BATCH_PENDING_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for full_name, response in pending.items():
+            f.write(json.dumps({"full_name": full_name, "response": response}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, BATCH_PENDING_FILE)
+
+def batch_followups(repo: Dict, json_result: Dict) -> Dict[str, str]:
+    """主要分析之后还需要请求LLM的步骤: 阶段 -> 提示词，与在线模式的第二步一致；
+    easy install能按规则确定(或未开启LLM兜底)时不需要请求"""
+    prompts = {}
+    is_mcp_related = json_result.get("is_mcp_related")
+    if is_mcp_related:
+        prompts["readme"] = build_readme_prompt(repo)
+    server_command = json_result.get("server_command") if is_mcp_related and json_result.get("is_mcp_server") else None
+    if server_command and EASY_INSTALL_LLM_FALLBACK and evaluate_easy_install(server_command)[0] is None:
+        prompts["easy_install"] = build_easy_install_prompt(server_command)
+    return prompts
+
+async def submit_batch(repos):
+    """把待分析仓库的提示词写成批量请求文件，custom_id为"full_name:阶段"。
+    还没有主要分析结果的仓库写主要分析请求，已有结果的仓库写README生成/easy install请求"""
+    pending = load_batch_pending()
+    model_config = MODEL_CONFIGS[BATCH_MODEL]
+    writer = writers.get(BATCH_REQUESTS_FILE, "w")
+    counts = Counter()
+    for repo in repos:
+        prefiltered, _ = await prepare_repo(repo, [BATCH_MODEL])
+        if prefiltered is not None:
+            continue
+        analysis_response = pending.get(repo["full_name"])
+        if analysis_response is None:
+            prompts = {"analysis": build_analysis_prompt(repo)}
+        else:
+            prompts = batch_followups(repo, await parse_analysis_response(analysis_response))
+        for stage, prompt in prompts.items():
+            schema = output_options(BATCH_RESPONSE_NAMES[stage]).get("schema")
+            writer.write(build_batch_request(
+                make_custom_id(repo["full_name"], stage), model_config, prompt, request_params(model_config, schema)
+            ))
+            counts[stage] += 1
+    await checkpoint()
+    details = ", ".join(f"{stage} {count}" for stage, count in counts.most_common())
+    await log(f"已写入 {sum(counts.values())} 个批量请求到 {BATCH_REQUESTS_FILE} ({details or '无'})")
+
+async def ingest_batch(repos):
+    """读取批量结果文件，按在线模式相同的解析和保存流程处理。
+    第二轮结果还没有返回的仓库记入等待文件，再次submit时会生成对应的请求"""
+    responses, errors = load_batch_results(BATCH_RESULTS_FILE)
+    await log(f"从 {BATCH_RESULTS_FILE} 读取到 {len(responses)} 个成功结果，{len(errors)} 个失败请求")
+    pending = load_batch_pending()
+    model_config = MODEL_CONFIGS[BATCH_MODEL]
+    counts = Counter()
+
+    def take(repo: Dict, stage: str):
+        custom_id = make_custom_id(repo["full_name"], stage)
+        body = responses.get(custom_id)
+        if body is not None:
+            llm_metrics.record(f"batch_{stage}", model_config, status=200, usage=body.get("usage"))
+        elif custom_id in errors:
+            counts["request_failed"] += 1
+        return body
+
+    for repo in repos:
+        try:
+            prefiltered, readme_stats = await prepare_repo(repo, [BATCH_MODEL])
+            if prefiltered is not None:
+                continue
+            
+            analysis_response = pending.get(repo["full_name"])
+            if analysis_response is None:
+                body = take(repo, "analysis")
+                if body is None:
+                    counts["missing"] += 1
+                    continue
+                analysis_response = response_content(body)
+            
+            json_result = await parse_analysis_response(analysis_response)
+            
+            bodies = {stage: take(repo, stage) for stage in batch_followups(repo, json_result)}
+            if any(body is None for body in bodies.values()):
+                pending[repo["full_name"]] = analysis_response
+                counts["waiting"] += 1
+                continue
+            
+            readme_content = None
+            if "readme" in bodies:
+                readme_content = await parse_readme_response(response_content(bodies["readme"]))
+            easy_install = None
+            server_command = json_result.get("server_command") if json_result.get("is_mcp_related") and json_result.get("is_mcp_server") else None
+            if server_command:
+                if "easy_install" in bodies:
+                    is_easy_install, reason = await parse_easy_install_response(response_content(bodies["easy_install"]))
+                    easy_install = (bool(is_easy_install), reason)
+                else:
+                    # 规则能确定或未开启LLM兜底，不会发起请求
+                    easy_install = await analyze_easy_install(None, server_command)
+            
+            await assemble_result(repo, json_result, readme_content, easy_install, readme_stats)
+            counts["done"] += 1
+        except Exception as e:
+            await save_error_result(repo, e)
+            counts["failed"] += 1
+        pending.pop(repo["full_name"], None)
+    
+    save_batch_pending(pending)
+    await checkpoint()
+    await log(
+        f"批量导入: 完成 {counts['done']}, 失败 {counts['failed']}, "
+        f"等待第二轮结果 {counts['waiting']}, 缺少主要分析结果 {counts['missing']} "
+        f"(其中请求失败 {counts['request_failed']})"
+    )
+    if counts["waiting"] or counts["missing"]:
+        await log("仍有仓库缺少结果，再次运行submit生成剩余的批量请求", level="WARN")
+
 async def main():
+    global llm_cache, state, pending_marks
     await log("开始MCP仓库分析...")
+    if LLM_CACHE_ENABLED:
+        llm_cache = LLMCache(LLM_CACHE_FILE, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE_DAYS)
+    state = PipelineState(STATE_DB_FILE)
+    pending_marks = PendingMarks(state)
     
     # 创建结果目录
     os.makedirs(RESULTS_DIR, exist_ok=True)
     
-    # 加载并去重仓库
+    # 逐行读取并去重仓库，通过有界队列分发给固定数量的worker，内存占用与输入规模无关
     repos = load_and_deduplicate_repos()
     
-    if not repos:
-        await log("没有需要处理的仓库，程序退出", level="WARN")
+    # 批量模式：提示词写入请求文件或从结果文件导入，不发起在线请求
+    if BATCH_MODE is not None:
+        if BATCH_MODE == "submit":
+            await submit_batch(repos)
+        elif BATCH_MODE == "ingest":
+            await ingest_batch(repos)
+        else:
+            raise ValueError(f"未知的BATCH_MODE: {BATCH_MODE}")
+        await writers.close_all()
+        pending_marks.flush()
+        await log(state.stats(STAGE_ANALYZE))
+        for line in llm_metrics.summary():
+            await log(line)
         return
-        
-    await log(f"加载了 {len(repos)} 个待处理仓库")
     
     # 创建信号量限制并发
     semaphore = asyncio.Semaphore(MAX_CONCURRENT)
     
+    # 显示进度的协程
+    async def show_progress(progress):
+        await log(str(progress))
+        # 定期把缓冲的结果落盘，并写入对应的处理状态
+        await checkpoint()
+    
     async with aiohttp.ClientSession() as session:
-        tasks = [
-            analyze_repo(session, repo, semaphore)
-            for repo in repos
-        ]
-        
-        # 显示进度的协程
-        async def show_progress():
-            total = len(tasks)
-            completed = 0
-            while completed < total:
-                completed = sum(1 for t in tasks if t.done())
-                await log(f"进度: {completed}/{total} ({completed/total*100:.1f}%)")
-                await asyncio.sleep(5)
-        
-        # 启动进度显示
-        progress_task = asyncio.create_task(show_progress())
+        # 批量初筛：并发分析中的仓库凑够TRIAGE_BATCH_SIZE个(或等待TRIAGE_BATCH_WAIT秒)后合并成一个请求
+        triage_batcher = None
+        if TRIAGE_ENABLED and TRIAGE_BATCH_SIZE > 1:
+            triage_batcher = MicroBatcher(
+                lambda batch: triage_batch(session, batch), TRIAGE_BATCH_SIZE, TRIAGE_BATCH_WAIT
+            )
         
-        # 等待所有分析任务完成
-        await asyncio.gather(*tasks)
-        
-        # 取消进度显示
-        progress_task.cancel()
+        progress = await run_worker_pool(
+            repos,
+            lambda repo: analyze_repo(session, repo, semaphore, triage_batcher),
+            MAX_CONCURRENT, on_progress=show_progress
+        )
+    
+    await writers.close_all()
+    pending_marks.flush()
+    await log(state.stats(STAGE_ANALYZE))
+    
+    await log("LLM调用统计:")
+    for line in llm_metrics.summary():
+        await log(line)
+    for line in llm_router.stats():
+        await log(line)
+    if PREFILTER_ENABLED:
+        await log(prefilter_stats.summary())
+    if TRIAGE_ENABLED:
+        await log(triage_stats.summary())
+        if triage_batcher is not None:
+            await log(f"初筛{triage_batcher.stats()}")
+    if llm_cache is not None:
+        await log(llm_cache.stats())
+    
+    if progress.queued == 0:
+        await log("没有需要处理的仓库，程序退出", level="WARN")
+        return
     
     await log("分析完成！")
 
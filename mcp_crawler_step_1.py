@@ -1,16 +1,28 @@
 import os
 import json
-import time
 import aiohttp
 import asyncio
-from datetime import datetime
+from collections import Counter, defaultdict
+from datetime import datetime, date, timedelta
 from urllib.parse import quote
 import config
+from github_governor import github_request
+from jsonl_writer import WriterPool, compact_jsonl
+from state_store import PipelineState, PendingMarks, STAGE_SEARCH, STATUS_DONE
 
 # 配置
-GITHUB_TOKEN = config.GITHUB_TOKEN
 OUTPUT_FILE = "mcp_basic_repos.jsonl"
 START_DATE = "2024-10-01"
+END_DATE = None  # 结束日期，None表示今天
+
+# 增量爬取配置
+INCREMENTAL = True                     # 增量模式：不清空输出文件，只搜索上次之后有推送的仓库
+STATE_FILE = "mcp_crawler_state.json"  # 每个查询的高水位线(已见到的最新pushed_at)
+
+# 按创建时间分片搜索配置
+SHARD_BY_DATE = True          # 是否按created时间窗口分片，突破单个查询1000条结果的限制
+SEARCH_RESULT_LIMIT = 1000    # GitHub单个搜索查询最多返回的结果数
+MAX_CONCURRENT_SHARDS = 4     # 同时爬取的分片数，所有分片共享github_governor中的search配额
 
 # 搜索关键词列表
 SEARCH_QUERIES = [
@@ -24,12 +36,80 @@ SEARCH_QUERIES = [
     "openai-mcp"
 ]
 
+# 所有输出文件的缓冲写入者
+writers = WriterPool()
+
+# 处理状态库：记录每个仓库被搜索到的版本，输出文件落盘后再写入(在main中打开)
+state = None
+pending_marks = None
+
+class RepoIndex:
+    """写入时去重的仓库索引：id -> (内容签名, 首次发现该仓库的查询序号)。
+    同一仓库再次出现且star/fork/更新时间没有变化时直接跳过，有变化时写入新记录(结束时按id合并)"""
+
+    HISTORY = -1  # 从已有输出文件加载的仓库
+
+    def __init__(self):
+        self.entries = {}
+        self.stats = defaultdict(Counter)   # 查询 -> {"new", "updated", "duplicate"}
+        self.overlap = defaultdict(Counter)  # 查询 -> {首次发现的查询序号: 重复数}
+
+    @staticmethod
+    def signature(repo_data: dict) -> int:
+        return hash((repo_data["stargazers_count"], repo_data["forks_count"], repo_data["updated_at"]))
+
+    def load(self, path: str):
+        """从已有输出文件加载索引"""
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    repo_data = json.loads(line.strip())
+                    self.entries[repo_data["id"]] = (self.signature(repo_data), self.HISTORY)
+                except (json.JSONDecodeError, KeyError):
+                    continue
+
+    def check(self, repo_data: dict, query: str) -> bool:
+        """记录一次发现，返回是否需要写入"""
+        query_index = SEARCH_QUERIES.index(query)
+        signature = self.signature(repo_data)
+        entry = self.entries.get(repo_data["id"])
+        if entry is None:
+            self.entries[repo_data["id"]] = (signature, query_index)
+            self.stats[query]["new"] += 1
+            return True
+        
+        self.overlap[query][entry[1]] += 1
+        if entry[0] == signature:
+            self.stats[query]["duplicate"] += 1
+            return False
+        self.entries[repo_data["id"]] = (signature, entry[1])
+        self.stats[query]["updated"] += 1
+        return True
+
+    def report(self) -> list:
+        lines = []
+        for query in SEARCH_QUERIES:
+            stats = self.stats[query]
+            total = sum(stats.values())
+            lines.append(
+                f"{query}: 共 {total} 条, 新增 {stats['new']}, 更新 {stats['updated']}, "
+                f"重复跳过 {stats['duplicate']} ({stats['duplicate']/total*100 if total else 0:.1f}%)"
+            )
+            for first_index, count in self.overlap[query].most_common():
+                source = "历史数据" if first_index == self.HISTORY else SEARCH_QUERIES[first_index]
+                lines.append(f"    与 {source} 重叠 {count} 条")
+        return lines
+
+repo_index = RepoIndex()
+
 async def log(message):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {message}")
 
-async def save_repo(repo):
-    """只保存基础仓库信息到JSONL文件"""
+async def save_repo(repo, query=None):
+    """只保存基础仓库信息到JSONL文件，已保存过且没有变化的仓库直接跳过"""
     try:
         repo_data = {
             "id": repo["id"],
@@ -40,6 +120,7 @@ async def save_repo(repo):
             "owner": repo["owner"]["login"],
             "created_at": repo["created_at"],
             "updated_at": repo["updated_at"],
+            "pushed_at": repo.get("pushed_at"),
             "language": repo["language"],
             "stargazers_count": repo["stargazers_count"],
             "forks_count": repo["forks_count"],
@@ -47,77 +128,222 @@ async def save_repo(repo):
             "crawled_at": datetime.now().isoformat()
         }
         
+        if query is not None and not repo_index.check(repo_data, query):
+            return repo_data
+        
         # 直接写入基础信息，不获取README
-        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
-            f.write(json.dumps(repo_data, ensure_ascii=False) + "\n")
+        writers.get(OUTPUT_FILE).write(repo_data)
+        pending_marks.add(repo_data["full_name"], STAGE_SEARCH, STATUS_DONE, version=repo_data["pushed_at"] or repo_data["updated_at"])
             
         await log(f"已保存基础信息: {repo['full_name']}")
+        return repo_data
         
     except Exception as e:
         await log(f"保存仓库 {repo['full_name']} 时出错: {str(e)}")
+        return None
 
-async def search_repositories(session, query, page=1):
-    """搜索GitHub仓库"""
+def load_watermarks() -> dict:
+    """加载每个查询的高水位线"""
+    if not os.path.exists(STATE_FILE):
+        return {}
     try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get("watermarks", {})
+    except (json.JSONDecodeError, OSError):
+        return {}
+
+def save_watermarks(watermarks: dict):
+    """保存每个查询的高水位线，先写临时文件再替换，避免中途退出导致文件损坏"""
+    tmp_file = STATE_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"watermarks": watermarks, "saved_at": datetime.now().isoformat()}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, STATE_FILE)
+
+def latest_timestamp(*values):
+    """返回ISO时间字符串中最新的一个，忽略空值"""
+    values = [v for v in values if v]
+    return max(values) if values else None
+
+def build_created_filter(window=None) -> str:
+    """生成created过滤条件，window为(开始日期, 结束日期)，None表示从START_DATE开始不限结束"""
+    if window is None:
+        return f">{START_DATE}"
+    start, end = window
+    return f"{start.isoformat()}..{end.isoformat()}"
+
+async def fetch_search_page(session, query, created, page=1, per_page=100, pushed_after=None):
+    """请求一页搜索结果，返回完整的响应数据"""
+    try:
+        pushed = f"+pushed:>={pushed_after}" if pushed_after else ""
         search_url = (
             "https://api.github.com/search/repositories"
-            f"?q={quote(query)}+created:>{START_DATE}"
-            f"&sort=updated&page={page}&per_page=100"
+            f"?q={quote(query)}+created:{created}{pushed}"
+            f"&sort=updated&page={page}&per_page={per_page}"
         )
         
+        # Authorization由github_request从token池中选择
         headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
             "Accept": "application/vnd.github.v3+json"
         }
         
-        async with session.get(search_url, headers=headers) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get("items", [])
-            elif response.status == 403:
-                # Rate limit exceeded
-                reset_time = int(response.headers.get("X-RateLimit-Reset", 0))
-                sleep_time = max(reset_time - time.time(), 0) + 10
-                await log(f"达到API限制，等待 {sleep_time} 秒...")
-                await asyncio.sleep(sleep_time)
-                return []
-            else:
-                await log(f"搜索请求失败: {response}")
-                return []
+        # 限流时github_request会等待并重新请求同一页，不会提前结束分页
+        status, data, _ = await github_request(session, "GET", search_url, resource="search", headers=headers)
+        if status == 200:
+            return data
+        else:
+            await log(f"搜索请求失败: HTTP {status}, {data}")
+            return None
                 
     except Exception as e:
         await log(f"搜索仓库时出错: {str(e)}")
+        return None
+
+async def search_repositories(session, query, page=1, created=None, pushed_after=None):
+    """搜索GitHub仓库，请求失败时返回None(与没有更多结果的空列表区分)"""
+    if created is None:
+        created = build_created_filter()
+    data = await fetch_search_page(session, query, created, page, pushed_after=pushed_after)
+    if data is None:
+        return None
+    return data.get("items", [])
+
+async def count_results(session, query, window, pushed_after=None):
+    """获取某个时间窗口内的搜索结果总数"""
+    data = await fetch_search_page(
+        session, query, build_created_filter(window),
+        per_page=1, pushed_after=pushed_after
+    )
+    if not data:
+        return None
+    return data.get("total_count", 0)
+
+async def split_into_shards(session, query, window, pushed_after=None) -> list:
+    """递归二分created时间窗口，直到每个窗口的结果数少于SEARCH_RESULT_LIMIT"""
+    start, end = window
+    total = await count_results(session, query, window, pushed_after)
+    if total is None:
+        # 无法获取数量时保留该窗口，按普通方式分页
+        return [window]
+    if total == 0:
         return []
+    if total < SEARCH_RESULT_LIMIT or start >= end:
+        if total >= SEARCH_RESULT_LIMIT:
+            await log(f"单日窗口 {start} 结果数 {total} 仍超过限制，部分结果将被截断: {query}")
+        return [window]
+    
+    middle = start + (end - start) // 2
+    left = await split_into_shards(session, query, (start, middle), pushed_after)
+    right = await split_into_shards(session, query, (middle + timedelta(days=1), end), pushed_after)
+    return left + right
+
+async def crawl_query(session, query, created, pushed_after=None):
+    """分页爬取单个查询(或单个分片)的全部结果，返回(见到的最新pushed_at, 是否完整)。
+    有页面请求失败或仓库保存失败时不完整，调用方不应推进水位线；
+    达到搜索结果上限(SEARCH_RESULT_LIMIT)后GitHub不再返回更多页，视为完整但记录截断"""
+    max_pages = SEARCH_RESULT_LIMIT // 100
+    page = 1
+    watermark = None
+    complete = True
+    while True:
+        await log(f"搜索: {query}, created:{created}, 页码: {page}")
+        repos = await search_repositories(session, query, page, created=created, pushed_after=pushed_after)
+        
+        if repos is None:
+            await log(f"查询 {query} (created:{created}) 第 {page} 页请求失败，之后的结果未爬取")
+            complete = False
+            break
+        if not repos:
+            break
+        
+        # 并发保存仓库信息
+        tasks = [save_repo(repo, query) for repo in repos]
+        saved = await asyncio.gather(*tasks)
+        if None in saved:
+            complete = False
+        watermark = latest_timestamp(watermark, *(r["pushed_at"] for r in saved if r))
+        
+        if len(repos) < 100:  # 最后一页
+            break
+        if page >= max_pages:
+            await log(f"查询 {query} (created:{created}) 已达到搜索结果上限 {SEARCH_RESULT_LIMIT}，之后的结果被截断")
+            break
+            
+        page += 1
+    
+    return watermark, complete
+
+async def crawl_query_sharded(session, query, pushed_after=None):
+    """按created时间窗口分片爬取单个查询，分片之间并发执行并共享速率限制，
+    返回(所有分片中最新的pushed_at, 是否所有分片都完整)"""
+    start = date.fromisoformat(START_DATE) + timedelta(days=1)  # 与created:>START_DATE保持一致
+    end = date.fromisoformat(END_DATE) if END_DATE else date.today()
+    shards = await split_into_shards(session, query, (start, end), pushed_after)
+    await log(f"查询 {query} 被拆分为 {len(shards)} 个时间分片")
+    
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SHARDS)
+    
+    async def crawl_shard(window):
+        async with semaphore:
+            return await crawl_query(session, query, build_created_filter(window), pushed_after)
+    
+    results = await asyncio.gather(*(crawl_shard(window) for window in shards))
+    return latest_timestamp(*(watermark for watermark, _ in results)), all(complete for _, complete in results)
 
 async def main():
+    global state, pending_marks
     await log("开始爬取MCP相关仓库...")
+    state = PipelineState(config.STATE_DB_FILE)
+    pending_marks = PendingMarks(state)
+    
+    if INCREMENTAL:
+        watermarks = load_watermarks()
+        await log(f"增量模式，已加载 {len(watermarks)} 个查询的高水位线")
+    else:
+        watermarks = {}
+        # 创建新的JSONL文件
+        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+            pass
     
-    # 创建新的JSONL文件
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        pass
+    repo_index.load(OUTPUT_FILE)
+    await log(f"已加载去重索引，已有 {len(repo_index.entries)} 个仓库")
     
     async with aiohttp.ClientSession() as session:
         for query in SEARCH_QUERIES:
-            page = 1
-            while True:
-                await log(f"搜索: {query}, 页码: {page}")
-                repos = await search_repositories(session, query, page)
-                
-                if not repos:
-                    break
-                
-                # 并发保存仓库信息
-                tasks = [save_repo(repo) for repo in repos]
-                await asyncio.gather(*tasks)
-                
-                if len(repos) < 100:  # 最后一页
-                    break
-                    
-                page += 1
-                await asyncio.sleep(1)  # 避免触发API限制
+            pushed_after = watermarks.get(query)
+            if pushed_after:
+                await log(f"查询 {query} 只搜索 {pushed_after} 之后有推送的仓库")
+            
+            if SHARD_BY_DATE:
+                watermark, complete = await crawl_query_sharded(session, query, pushed_after)
+            else:
+                watermark, complete = await crawl_query(session, query, build_created_filter(), pushed_after=pushed_after)
+            
+            # 每个查询完成后先把记录落盘，再保存水位线，中途退出时已完成的查询不会重复爬取
+            await writers.checkpoint_all()
+            pending_marks.flush()
+            if INCREMENTAL:
+                if complete:
+                    watermarks[query] = latest_timestamp(pushed_after, watermark)
+                    save_watermarks(watermarks)
+                else:
+                    # 有页面或分片失败时保留原水位线，下次运行重新搜索这段时间，避免失败页上的仓库被永久跳过
+                    await log(f"查询 {query} 未完整爬取，保留原水位线 {pushed_after}")
+    
+    await writers.close_all()
+    pending_marks.flush()
+    await log(state.stats(STAGE_SEARCH))
+    
+    await log("各查询去重统计:")
+    for line in repo_index.report():
+        await log(line)
+    
+    # 有更新记录时同一id会出现多行，按id合并保留最新一条
+    if any(stats["updated"] for stats in repo_index.stats.values()):
+        # 保留最新的一条，更新后的star/fork数覆盖旧值
+        total = compact_jsonl(OUTPUT_FILE, "id")
+        await log(f"已按id合并输出文件，共 {total} 个仓库")
     
     await log("爬取完成！")
 
 if __name__ == "__main__":
     asyncio.run(main()) 
-    
\ No newline at end of file
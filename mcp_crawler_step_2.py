@@ -1,56 +1,114 @@
 import os
 import json
-import time
 import aiohttp
 import asyncio
 from datetime import datetime
 import base64
 import config
+from github_governor import github_request
+from http_cache import ConditionalCache
+from jsonl_writer import WriterPool, compact_jsonl
+from adaptive_limiter import AIMDLimiter
+from worker_pool import run_worker_pool
+from readme_store import ReadmeStore, git_blob_sha
+from state_store import PipelineState, PendingMarks, row_finished, STAGE_README, STATUS_DONE, STATUS_FAILED
 
 # 配置
-GITHUB_TOKEN = config.GITHUB_TOKEN
 INPUT_FILE = "mcp_basic_repos.jsonl"
 OUTPUT_FILE = "mcp_full_repos.jsonl"
 FAILED_REPOS_FILE = "mcp_failed_repos.jsonl"
-MAX_CONCURRENT = 3  # 最大并发数
-RETRY_DELAY = 60    # 触发限制时的等待时间(秒)
-REQUEST_DELAY = 2   # 请求间隔(秒)
+# 并发数由AIMD自适应调整：响应正常时逐步增加，遇到403/429/5xx或延迟升高时减半
+INITIAL_CONCURRENT = 3  # 初始并发数
+MAX_CONCURRENT = 32     # 并发数上限
+REQUEST_DELAY = 2   # 请求失败后的重试间隔基数(秒)，限流等待由github_governor根据响应头处理
+
+# 刷新模式：比较第一步中仓库的pushed_at/updated_at与已保存的版本，只重新获取有变化的仓库，
+# 并覆盖(而不是追加)旧记录；关闭时已保存过的仓库永远跳过
+REFRESH_MODE = True
+
+# README获取方式: "rest" 每个仓库一次REST请求; "graphql" 一次GraphQL请求批量获取多个仓库的元数据和README
+README_BACKEND = "graphql"
+# REST请求的ETag条件请求缓存，README未变化时返回304，不消耗配额
+USE_HTTP_CACHE = True
+HTTP_CACHE_DIR = ".http_cache"
+http_cache = ConditionalCache(HTTP_CACHE_DIR) if USE_HTTP_CACHE else None
+GRAPHQL_URL = "https://api.github.com/graphql"
+GRAPHQL_BATCH_SIZE = 40  # 每个GraphQL请求包含的仓库数
+README_CANDIDATES = ["README.md", "readme.md", "Readme.md", "README.rst", "README"]  # GraphQL按顺序尝试的README路径
+
+# README内容按blob sha压缩保存在独立的存储中，输出文件只保存sha引用
+README_STORE_DIR = "readme_store"
+readme_store = ReadmeStore(README_STORE_DIR)
+
+GRAPHQL_REPO_FRAGMENT = """
+fragment RepoFields on Repository {
+  stargazerCount
+  forkCount
+  pushedAt
+  updatedAt
+  repositoryTopics(first: 20) { nodes { topic { name } } }
+%s
+}
+""" % "\n".join(
+    f'  readme{i}: object(expression: "HEAD:{path}") {{ ... on Blob {{ oid text byteSize isBinary isTruncated }} }}'
+    for i, path in enumerate(README_CANDIDATES)
+)
+
+# 所有输出文件的缓冲写入者，每个文件只有一个写入者
+writers = WriterPool()
+
+# 处理状态库：仓库是否已获取README、获取时的版本和README sha都通过主键查询，
+# mcp_full_repos.jsonl和mcp_failed_repos.jsonl只作为导出(第三步仍从mcp_full_repos.jsonl读取)；在main中打开
+state = None
+pending_marks = None
 
 async def log(message):
     """输出带时间戳的日志"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {message}")
 
-def load_processed_repos() -> set:
-    """加载已处理的仓库列表"""
-    processed = set()
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    repo_data = json.loads(line.strip())
-                    processed.add(repo_data["full_name"])
-                except:
-                    continue
-    return processed
+def repo_version(repo_data: dict):
+    """仓库的版本标识，有新推送或更新时会变化"""
+    return repo_data.get("pushed_at") or repo_data.get("updated_at")
 
-def load_failed_repos() -> set:
-    """加载已知失败的仓库列表"""
-    failed = set()
-    if os.path.exists(FAILED_REPOS_FILE):
-        with open(FAILED_REPOS_FILE, "r", encoding="utf-8") as f:
+def import_legacy_files() -> int:
+    """状态库中还没有README阶段的记录时，从旧版本的输出文件和失败文件导入"""
+    if state.has_stage(STAGE_README):
+        return 0
+    rows = []
+    # 先导入失败记录，之后成功获取过的仓库以成功记录为准
+    for path, status in ((FAILED_REPOS_FILE, STATUS_FAILED), (OUTPUT_FILE, STATUS_DONE)):
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
             for line in f:
                 try:
                     repo_data = json.loads(line.strip())
-                    failed.add(repo_data["full_name"])
+                    rows.append({
+                        "full_name": repo_data["full_name"],
+                        "stage": STAGE_README,
+                        "status": status,
+                        "attempts": 1 if status == STATUS_FAILED else 0,
+                        # GraphQL会刷新pushed_at，因此优先比较获取时第一步中的版本
+                        "version": repo_data.get("readme_source_version") or repo_version(repo_data),
+                        "content_hash": (repo_data.get("readme") or {}).get("sha"),
+                        "error": repo_data.get("error_message")
+                    })
                 except:
                     continue
-    return failed
+    return state.import_rows(rows)
+
+def needs_fetch(repo_data: dict, stored: dict) -> bool:
+    """判断仓库是否需要(重新)获取README，stored为状态库中成功获取的记录"""
+    if stored is None:
+        return True
+    if not REFRESH_MODE:
+        return False
+    return stored["version"] != repo_version(repo_data)
 
-def load_and_deduplicate_repos(input_file: str) -> list:
-    """加载并去重第一阶段的仓库数据"""
+def load_and_deduplicate_repos(input_file: str):
+    """逐行读取并去重第一阶段的仓库数据(生成器，不会一次性加载整个文件)"""
     seen_repos = set()
-    unique_repos = []
     
     with open(input_file, "r", encoding="utf-8") as f:
         for line in f:
@@ -59,11 +117,37 @@ def load_and_deduplicate_repos(input_file: str) -> list:
                 full_name = repo_data["full_name"]
                 if full_name not in seen_repos:
                     seen_repos.add(full_name)
-                    unique_repos.append(repo_data)
+                    yield repo_data
             except json.JSONDecodeError:
                 continue
-    
-    return unique_repos
+
+def iter_pending_repos(counts: dict):
+    """过滤掉已知失败的仓库以及已处理且没有变化的仓库，counts中记录跳过和刷新的数量"""
+    for repo in load_and_deduplicate_repos(INPUT_FILE):
+        row = state.get(repo["full_name"], STAGE_README)
+        if row is not None and row["status"] == STATUS_FAILED:
+            if row_finished(row, config.STATE_MAX_ATTEMPTS):
+                counts["failed"] += 1
+                continue
+            row = None
+        if not needs_fetch(repo, row):
+            counts["unchanged"] += 1
+            continue
+        if row is not None:
+            counts["refreshed"] += 1
+        repo["readme_source_version"] = repo_version(repo)
+        yield repo
+
+def iter_batches(items, size: int):
+    """把可迭代对象按size分批"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 async def record_failed_repo(repo_data: dict, error_msg: str):
     """记录失败的仓库信息"""
@@ -72,46 +156,38 @@ async def record_failed_repo(repo_data: dict, error_msg: str):
         "error_message": error_msg,
         "failed_at": datetime.now().isoformat()
     }
-    async with asyncio.Lock():
-        with open(FAILED_REPOS_FILE, "a", encoding="utf-8") as f:
-            f.write(json.dumps(failed_data, ensure_ascii=False) + "\n")
+    writers.get(FAILED_REPOS_FILE).write(failed_data)
+    pending_marks.add(repo_data["full_name"], STAGE_README, STATUS_FAILED, error=error_msg)
 
-async def get_repo_readme(session, repo_full_name, semaphore, max_retries=3):
+async def get_repo_readme(session, repo_full_name, limiter, max_retries=3):
     """获取仓库的README内容，支持重试"""
-    async with semaphore:
+    async with limiter:
         retries = 0
         last_error = None
         
         while retries <= max_retries:
             try:
-                await asyncio.sleep(REQUEST_DELAY)
-                
                 readme_url = f"https://api.github.com/repos/{repo_full_name}/readme"
-                headers = {"Authorization": f"token {GITHUB_TOKEN}"}
+                status, data, _ = await github_request(
+                    session, "GET", readme_url, cache=http_cache, on_response=limiter.observe, timeout=10
+                )
+                if status == 200:
+                    content = base64.b64decode(data["content"]).decode("utf-8")
+                    return {
+                        "content": content,
+                        "size": len(content),
+                        "path": data.get("path", ""),
+                        "sha": data.get("sha", "")
+                    }
                 
-                async with session.get(readme_url, headers=headers, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        content = base64.b64decode(data["content"]).decode("utf-8")
-                        return {
-                            "content": content,
-                            "size": len(content),
-                            "path": data.get("path", ""),
-                            "sha": data.get("sha", "")
-                        }
-                    elif resp.status == 403:  # Rate limit exceeded
-                        reset_time = int(resp.headers.get("X-RateLimit-Reset", 0))
-                        wait_time = max(reset_time - time.time(), 0) + 5
-                        await log(f"达到API限制，等待 {wait_time} 秒...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    
-                    last_error = f"HTTP状态码: {resp.status}"
-                    if retries < max_retries:
-                        retries += 1
-                        await log(f"获取README失败: {repo_full_name}, {last_error}, 第{retries}次重试...")
-                        await asyncio.sleep(REQUEST_DELAY * (retries + 1))
-                        continue
+                last_error = f"HTTP状态码: {status}"
+                if status == 404:  # 仓库没有README，重试没有意义
+                    break
+                if retries < max_retries:
+                    retries += 1
+                    await log(f"获取README失败: {repo_full_name}, {last_error}, 第{retries}次重试...")
+                    await asyncio.sleep(REQUEST_DELAY * (retries + 1))
+                    continue
             except Exception as e:
                 last_error = str(e)
                 if retries < max_retries:
@@ -119,31 +195,154 @@ async def get_repo_readme(session, repo_full_name, semaphore, max_retries=3):
                     await log(f"获取README出错: {repo_full_name}, 错误: {last_error}, 第{retries}次重试...")
                     await asyncio.sleep(REQUEST_DELAY * (retries + 1))
                     continue
+            break
         
         return {"error": f"获取README最终失败: {last_error}"}
 
-async def process_repo(repo_data, session, semaphore, processed_repos):
+def build_graphql_query(repos: list) -> str:
+    """为一批仓库生成带别名的GraphQL查询，每个仓库一个别名r0..rN"""
+    fields = []
+    for i, repo in enumerate(repos):
+        owner, name = repo["full_name"].split("/", 1)
+        fields.append(f"  r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ ...RepoFields }}")
+    return (
+        "query {\n  rateLimit { cost remaining resetAt }\n"
+        + "\n".join(fields)
+        + "\n}\n"
+        + GRAPHQL_REPO_FRAGMENT
+    )
+
+def parse_graphql_readme(node: dict):
+    """从GraphQL仓库节点中取出第一个可用的README，格式与get_repo_readme一致；找不到或内容被截断时返回None"""
+    for i, path in enumerate(README_CANDIDATES):
+        blob = node.get(f"readme{i}")
+        if not blob or blob.get("isBinary") or blob.get("text") is None:
+            continue
+        if blob.get("isTruncated"):
+            return None
+        content = blob["text"]
+        return {
+            "content": content,
+            "size": len(content),
+            "path": path,
+            "sha": blob.get("oid", "")
+        }
+    return None
+
+async def fetch_repos_graphql(session, repos: list, limiter, max_retries=3):
+    """通过一次GraphQL请求获取一批仓库的元数据和README，返回 {别名: 仓库节点或None}"""
+    async with limiter:
+        retries = 0
+        last_error = None
+        query = build_graphql_query(repos)
+        
+        while retries <= max_retries:
+            try:
+                status, data, _ = await github_request(
+                    session, "POST", GRAPHQL_URL, resource="graphql",
+                    json={"query": query}, on_response=limiter.observe, timeout=60
+                )
+                if status == 200:
+                    # 部分仓库不存在时GraphQL仍返回200，对应别名为null并附带errors
+                    if data.get("data") is None:
+                        last_error = f"GraphQL错误: {data.get('errors')}"
+                    else:
+                        rate_limit = data["data"].get("rateLimit") or {}
+                        await log(f"GraphQL批量请求完成: {len(repos)} 个仓库, 消耗 {rate_limit.get('cost')} 点, 剩余 {rate_limit.get('remaining')} 点")
+                        return data["data"]
+                else:
+                    last_error = f"HTTP状态码: {status}"
+            except Exception as e:
+                last_error = str(e)
+            
+            if retries < max_retries:
+                retries += 1
+                await log(f"GraphQL批量请求失败: {last_error}, 第{retries}次重试...")
+                await asyncio.sleep(REQUEST_DELAY * (retries + 1))
+                continue
+            break
+        
+        return {"error": f"GraphQL批量请求最终失败: {last_error}"}
+
+async def save_processed_repo(repo_data, readme_data, processed_repos):
+    """保存带README信息的仓库记录，README内容写入readme_store，记录中只保留sha引用"""
+    readme_data = dict(readme_data)
+    content = readme_data.pop("content")
+    if not readme_data.get("sha"):
+        readme_data["sha"] = git_blob_sha(content)
+    
+    # 相同sha的README已经保存过时不会重复写入
+    written = await asyncio.to_thread(readme_store.put, readme_data["sha"], content)
+    stored = state.get(repo_data["full_name"], STAGE_README)
+    if not written and stored and stored["content_hash"] == readme_data["sha"]:
+        await log(f"README未变化: {repo_data['full_name']}")
+    
+    repo_data["readme"] = readme_data
+    repo_data["readme_updated_at"] = datetime.now().isoformat()
+    
+    writers.get(OUTPUT_FILE).write(repo_data)
+    pending_marks.add(
+        repo_data["full_name"], STAGE_README, STATUS_DONE,
+        version=repo_data.get("readme_source_version") or repo_version(repo_data),
+        content_hash=readme_data["sha"]
+    )
+    processed_repos.add(repo_data["full_name"])
+        
+    await log(f"已更新README信息: {repo_data['full_name']}")
+
+async def process_repo_batch(repos, session, limiter, processed_repos):
+    """用GraphQL批量处理一组仓库，输出格式与process_repo相同"""
+    repos = [repo for repo in repos if repo["full_name"] not in processed_repos]
+    if not repos:
+        return
+    
+    data = await fetch_repos_graphql(session, repos, limiter)
+    if "error" in data:
+        for repo_data in repos:
+            await record_failed_repo(repo_data, data["error"])
+        return
+    
+    for i, repo_data in enumerate(repos):
+        try:
+            node = data.get(f"r{i}")
+            if node is None:
+                await record_failed_repo(repo_data, "获取README最终失败: 仓库不存在或无权访问")
+                continue
+            
+            # 顺便刷新元数据
+            repo_data["stargazers_count"] = node["stargazerCount"]
+            repo_data["forks_count"] = node["forkCount"]
+            repo_data["pushed_at"] = node["pushedAt"]
+            repo_data["updated_at"] = node["updatedAt"]
+            repo_data["topics"] = [t["topic"]["name"] for t in node["repositoryTopics"]["nodes"]]
+            
+            readme_data = parse_graphql_readme(node)
+            if readme_data is None:
+                # README不在候选路径或内容被截断，回退到REST接口
+                await process_repo(repo_data, session, limiter, processed_repos)
+                continue
+            
+            await save_processed_repo(repo_data, readme_data, processed_repos)
+        
+        except Exception as e:
+            error_msg = f"处理仓库时发生错误: {str(e)}"
+            await log(f"{error_msg}: {repo_data['full_name']}")
+            await record_failed_repo(repo_data, error_msg)
+
+async def process_repo(repo_data, session, limiter, processed_repos):
     """处理单个仓库，添加README信息"""
     try:
         if repo_data["full_name"] in processed_repos:
             await log(f"跳过已处理的仓库: {repo_data['full_name']}")
             return
 
-        readme_data = await get_repo_readme(session, repo_data["full_name"], semaphore)
+        readme_data = await get_repo_readme(session, repo_data["full_name"], limiter)
         
         if readme_data and "error" in readme_data:
             await record_failed_repo(repo_data, readme_data["error"])
             return
 
-        repo_data["readme"] = readme_data
-        repo_data["readme_updated_at"] = datetime.now().isoformat()
-        
-        async with asyncio.Lock():
-            with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
-                f.write(json.dumps(repo_data, ensure_ascii=False) + "\n")
-            processed_repos.add(repo_data["full_name"])
-            
-        await log(f"已更新README信息: {repo_data['full_name']}")
+        await save_processed_repo(repo_data, readme_data, processed_repos)
         
     except Exception as e:
         error_msg = f"处理仓库时发生错误: {str(e)}"
@@ -151,42 +350,61 @@ async def process_repo(repo_data, session, semaphore, processed_repos):
         await record_failed_repo(repo_data, error_msg)
 
 async def main():
+    global state, pending_marks
     await log("开始获取仓库README信息...")
+    state = PipelineState(config.STATE_DB_FILE)
+    pending_marks = PendingMarks(state)
     
-    # 创建信号量控制并发
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    # 自适应并发控制
+    limiter = AIMDLimiter(initial=INITIAL_CONCURRENT, max_limit=MAX_CONCURRENT)
     
-    # 加载已处理和失败的仓库
-    processed_repos = load_processed_repos()
-    failed_repos = load_failed_repos()
-    await log(f"已处理的仓库数量: {len(processed_repos)}")
-    await log(f"失败的仓库数量: {len(failed_repos)}")
+    # 首次使用状态库时从旧文件导入已处理和失败的仓库
+    imported = import_legacy_files()
+    if imported:
+        await log(f"已从旧输出文件导入 {imported} 条记录到状态库")
+    counts_by_status = state.counts(STAGE_README)
+    await log(f"已处理的仓库数量: {counts_by_status.get(STATUS_DONE, 0)}")
+    await log(f"失败的仓库数量: {counts_by_status.get(STATUS_FAILED, 0)}")
     
-    # 读取并去重第一步的基础信息
-    repos = load_and_deduplicate_repos(INPUT_FILE)
-    # 过滤掉已知失败的仓库
-    repos = [repo for repo in repos if repo["full_name"] not in failed_repos]
-    await log(f"加载了 {len(repos)} 个待处理的仓库基础信息")
+    # 逐行读取第一步的基础信息，通过有界队列分发给固定数量的worker
+    counts = {"failed": 0, "unchanged": 0, "refreshed": 0}
+    repos = iter_pending_repos(counts)
+    
+    # 本次运行已完成的仓库
+    processed_repos = set()
+    
+    async def show_progress(progress):
+        await log(f"{progress}, 成功 {len(processed_repos)}, {limiter.stats()}")
+        # 定期把缓冲的记录落盘，再写入对应的处理状态
+        await writers.checkpoint_all()
+        pending_marks.flush()
     
     async with aiohttp.ClientSession() as session:
-        tasks = [
-            process_repo(repo, session, semaphore, processed_repos)
-            for repo in repos
-        ]
-        
-        async def show_progress():
-            total = len(tasks)
-            while True:
-                completed = len(processed_repos)
-                await log(f"进度: {completed}/{total} ({completed/total*100:.1f}%)")
-                if completed >= total:
-                    break
-                await asyncio.sleep(10)
-        
-        progress_task = asyncio.create_task(show_progress())
-        await asyncio.gather(*tasks)
-        await progress_task
+        # worker数取并发上限，实际并发由limiter控制
+        if README_BACKEND == "graphql":
+            await run_worker_pool(
+                iter_batches(repos, GRAPHQL_BATCH_SIZE),
+                lambda batch: process_repo_batch(batch, session, limiter, processed_repos),
+                MAX_CONCURRENT, weight=len, on_progress=show_progress
+            )
+        else:
+            await run_worker_pool(
+                repos,
+                lambda repo: process_repo(repo, session, limiter, processed_repos),
+                MAX_CONCURRENT, on_progress=show_progress
+            )
+    
+    await writers.close_all()
+    pending_marks.flush()
+    await log(f"跳过已知失败 {counts['failed']} 个, 跳过未变化 {counts['unchanged']} 个, 刷新 {counts['refreshed']} 个")
+    
+    # 刷新模式下同一仓库可能有新旧两条记录(包括之前中断的运行留下的)，按full_name合并为一条
+    if REFRESH_MODE:
+        total = compact_jsonl(OUTPUT_FILE, "full_name")
+        await log(f"已按full_name合并输出文件，共 {total} 个仓库")
     
+    if http_cache is not None:
+        await log(http_cache.stats())
     await log("README信息获取完成！")
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+import re
+from typing import Dict, List, Tuple
+
+# 正向特征：(名称, 正则, 权重)，命中即说明仓库很可能与Model Context Protocol相关
+POSITIVE_SIGNALS = [
+    ("mcp_sdk", re.compile(r"@modelcontextprotocol/|modelcontextprotocol/\w+-sdk", re.I), 5),
+    ("mcp_servers_config", re.compile(r"[\"']?mcpServers[\"']?\s*:"), 5),
+    ("fastmcp", re.compile(r"\bFastMCP\b", re.I), 4),
+    ("model_context_protocol", re.compile(r"model[\s\-_]*context[\s\-_]*protocol", re.I), 4),
+    ("python_sdk", re.compile(r"^\s*(from mcp(\.server)?\b|import mcp\b)|\bpip install mcp\b", re.I | re.M), 3),
+    ("stdio_transport", re.compile(r"StdioServerTransport|stdio[\s\-_]*(transport|server)|transport[\"'\s:=]+stdio", re.I), 3),
+    ("claude_desktop", re.compile(r"claude_desktop_config|claude[\s\-]*desktop", re.I), 2),
+    ("mcp_tools", re.compile(r"@mcp\.(tool|resource|prompt)|list_tools|tools/list|call_tool", re.I), 2),
+    ("sse_transport", re.compile(r"SSEServerTransport|streamable[\s\-]*http", re.I), 2),
+    ("mcp_client_apps", re.compile(r"\b(Cursor|Cline|Windsurf|Continue\.dev|Zed)\b"), 1),
+    ("mcp_server_phrase", re.compile(r"\bmcp[\s\-_]*(server|client|tool)s?\b", re.I), 1),
+    ("mcp_chinese", re.compile(r"MCP\s*(服务|协议|工具|客户端)", re.I), 3),
+]
+
+# 仓库名或topics中单独的mcp词(如notion-mcp、mcp_weather)，只匹配名称和topics，README中的mcp太常见
+NAME_SIGNAL = ("mcp_in_name", re.compile(r"(?<![a-z0-9])mcp(?![a-z0-9])", re.I), 2)
+
+# 负向特征：常见的同名"MCP"(Minecraft Coder Pack、Microchip芯片、微软认证等)
+NEGATIVE_SIGNALS = [
+    ("minecraft", re.compile(r"minecraft|\bforge\b|fabric[\s\-]*mod|mod[\s\-]*coder[\s\-]*pack|\bsrg\b|mcp[\s\-_]*mappings", re.I), -4),
+    ("microchip", re.compile(r"\bMCP\d{3,5}\b|microcontroller|arduino|esp32|\bI2C\b|\bSPI\b", re.I), -3),
+    ("microsoft_cert", re.compile(r"microsoft[\s\-]*certified|\bMCP exam", re.I), -3),
+    ("master_control_program", re.compile(r"master[\s\-]*control[\s\-]*program", re.I), -2),
+]
+
+def score_repo(repo: Dict, readme: str) -> Tuple[int, List[str]]:
+    """根据仓库名、描述、topics和README计算MCP相关性得分，返回(得分, 命中的特征名列表)。
+    每个特征只计一次，结果是确定性的，不依赖任何网络请求"""
+    text = "\n".join([
+        repo.get("full_name") or "",
+        repo.get("description") or "",
+        " ".join(repo.get("topics") or []),
+        readme or ""
+    ])
+    score = 0
+    signals = []
+    for name, pattern, weight in POSITIVE_SIGNALS + NEGATIVE_SIGNALS:
+        if pattern.search(text):
+            score += weight
+            signals.append(name)
+    name, pattern, weight = NAME_SIGNAL
+    if pattern.search(" ".join([repo.get("name") or "", *(repo.get("topics") or [])])):
+        score += weight
+        signals.append(name)
+    return score, signals
+
+NEGATIVE_SIGNAL_NAMES = {name for name, _, _ in NEGATIVE_SIGNALS}
+
+def is_clear_negative(score: int, signals: List[str], reject_score: int) -> bool:
+    """命中了负向特征且得分不高于reject_score的仓库视为明确与MCP无关，不再调用LLM。
+    没有命中任何特征(例如README很短或是中文)不算负面证据，仍交给LLM判断"""
+    return score <= reject_score and any(name in NEGATIVE_SIGNAL_NAMES for name in signals)
+
+class PrefilterStats:
+    """统计预筛选的排除数量，以及在已有LLM标注结果上的准确率(被排除的仓库中确实与MCP无关的比例)"""
+
+    def __init__(self):
+        self.rejected = 0
+        self.passed = 0
+        self.labelled = 0
+        self.labelled_rejected = 0
+        self.labelled_true_negative = 0
+        self.labelled_negative = 0
+
+    def record(self, rejected: bool):
+        if rejected:
+            self.rejected += 1
+        else:
+            self.passed += 1
+
+    def record_labelled(self, rejected: bool, is_mcp_related: bool):
+        """记录一个已由LLM标注过的仓库：预筛选是否会排除它，以及LLM的标注结果"""
+        self.labelled += 1
+        if not is_mcp_related:
+            self.labelled_negative += 1
+        if rejected:
+            self.labelled_rejected += 1
+            if not is_mcp_related:
+                self.labelled_true_negative += 1
+
+    def precision_summary(self) -> str:
+        if not self.labelled_rejected:
+            return f"预筛选在 {self.labelled} 个已标注结果上未排除任何仓库 (LLM标注的非MCP仓库 {self.labelled_negative} 个)"
+        precision = self.labelled_true_negative / self.labelled_rejected * 100
+        recall = self.labelled_true_negative / self.labelled_negative * 100 if self.labelled_negative else 0
+        return (
+            f"预筛选在 {self.labelled} 个已标注结果上的准确率: {self.labelled_true_negative}/{self.labelled_rejected} ({precision:.1f}%), "
+            f"覆盖LLM标注的非MCP仓库 {self.labelled_true_negative}/{self.labelled_negative} ({recall:.1f}%)"
+        )
+
+    def summary(self) -> str:
+        total = self.rejected + self.passed
+        rate = self.rejected / total * 100 if total else 0
+        return f"预筛选排除 {self.rejected}/{total} ({rate:.1f}%) 个仓库，未调用LLM"
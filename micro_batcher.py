@@ -0,0 +1,62 @@
+import asyncio
+
+class MicroBatcher:
+    """把并发协程提交的单个任务攒成批次处理：攒够max_size个或第一个任务等待超过max_wait秒时，
+    调用process_batch(items)一次处理整批，返回与items顺序一致的结果列表，再分别交还给各个提交者。
+    用法: result = await batcher.submit(item)"""
+
+    def __init__(self, process_batch, max_size: int, max_wait: float):
+        self.process_batch = process_batch
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.pending = []   # (item, future)
+        self.timer = None
+        self.tasks = set()  # 正在处理的批次，保留引用避免任务被回收
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_wait)
+        self.timer = None
+        self._flush()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"批处理结果数量({len(results)})与任务数量({len(batch)})不一致")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            # 提交者可能已被取消
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> str:
+        average = self.items / self.batches if self.batches else 0
+        return f"批处理 {self.batches} 次，共 {self.items} 个任务，平均每批 {average:.1f} 个"
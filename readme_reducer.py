@@ -0,0 +1,127 @@
+import re
+from typing import Dict, List, Tuple
+
+DEFAULT_TOKEN_BUDGET = 8000
+
+# 章节优先级：数字越小越优先保留
+PRIORITY_CONFIG = 0     # 包含mcpServers配置的章节
+PRIORITY_INTRO = 1      # 第一个标题之前的简介
+PRIORITY_KEY = 2        # 安装、配置、使用等关键章节
+PRIORITY_NORMAL = 3
+PRIORITY_LOW = 4        # 更新日志、许可证、贡献者等
+
+KEY_SECTION_PATTERN = re.compile(
+    r"install|setup|set up|config|usage|quick\s*start|getting\s*started|tools?\b|features?|"
+    r"run|deploy|docker|environment|api|安装|配置|使用|快速开始|部署|工具|功能|环境变量",
+    re.I
+)
+LOW_SECTION_PATTERN = re.compile(
+    r"change\s*log|changes|release|history|licen[cs]e|contribut|acknowledg|credit|sponsor|"
+    r"star\s*history|support|faq|roadmap|todo|更新日志|版本|许可|贡献|致谢|赞助",
+    re.I
+)
+
+HTML_COMMENT = re.compile(r"<!--.*?-->", re.S)
+BADGE = re.compile(r"\[!\[[^\]]*\]\([^)]*\)\]\([^)]*\)")
+IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+HTML_IMG = re.compile(r"<img\b[^>]*>", re.I)
+HTML_TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+BLANK_LINES = re.compile(r"\n{3,}")
+CJK = re.compile(r"[　-鿿가-힯＀-￯]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符每个约1个token，其余约4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def clean_markdown(text: str) -> str:
+    """去掉徽章、图片、HTML注释和标签(保留标签内的文字)，合并多余空行"""
+    text = HTML_COMMENT.sub("", text)
+    text = BADGE.sub("", text)
+    text = IMAGE.sub("", text)
+    text = HTML_IMG.sub("", text)
+    text = HTML_TAG.sub("", text)
+    text = "\n".join(line.rstrip() for line in text.splitlines())
+    return BLANK_LINES.sub("\n\n", text).strip()
+
+def split_sections(text: str) -> List[str]:
+    """按Markdown标题切分章节，代码块内的#不视为标题"""
+    sections = []
+    current = []
+    in_code = False
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        if not in_code and re.match(r"#{1,6}\s", line) and current:
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+def section_priority(section: str, index: int) -> int:
+    if "mcpServers" in section:
+        return PRIORITY_CONFIG
+    heading = section.split("\n", 1)[0]
+    if not heading.startswith("#"):
+        return PRIORITY_INTRO if index == 0 else PRIORITY_NORMAL
+    if LOW_SECTION_PATTERN.search(heading):
+        return PRIORITY_LOW
+    if KEY_SECTION_PATTERN.search(heading):
+        return PRIORITY_KEY
+    return PRIORITY_NORMAL
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按行截断到max_tokens以内，截断处保证代码块闭合"""
+    lines = []
+    used = 0
+    in_code = False
+    for line in text.splitlines():
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        lines.append(line)
+        used += cost
+    if in_code:
+        lines.append("```")
+    return "\n".join(lines)
+
+def condense_readme(text: str, max_tokens: int = DEFAULT_TOKEN_BUDGET) -> Tuple[str, Dict]:
+    """清理README并按章节优先级压缩到max_tokens以内，章节保持原有顺序。
+    返回(压缩后的文本, 统计信息)"""
+    text = text or ""
+    cleaned = clean_markdown(text)
+    sections = split_sections(cleaned)
+
+    # 按优先级贪心选取章节，放不下的章节截断后用完剩余预算
+    budget = max_tokens
+    selected = {}
+    order = sorted(range(len(sections)), key=lambda i: (section_priority(sections[i], i), i))
+    for i in order:
+        if budget <= 0:
+            break
+        cost = estimate_tokens(sections[i]) + 1
+        if cost <= budget:
+            selected[i] = sections[i]
+            budget -= cost
+        else:
+            partial = truncate_to_tokens(sections[i], budget)
+            if partial.strip():
+                selected[i] = partial
+                budget -= estimate_tokens(partial) + 1
+
+    reduced = "\n\n".join(selected[i] for i in sorted(selected))
+    stats = {
+        "original_chars": len(text),
+        "original_tokens": estimate_tokens(text),
+        "reduced_chars": len(reduced),
+        "reduced_tokens": estimate_tokens(reduced),
+        "sections_kept": len(selected),
+        "sections_total": len(sections)
+    }
+    return reduced, stats
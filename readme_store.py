@@ -0,0 +1,44 @@
+import os
+import gzip
+import hashlib
+
+STORE_DIR = "readme_store"
+
+def git_blob_sha(content: str) -> str:
+    """按git的方式计算内容的blob sha，与GitHub返回的README sha一致"""
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+class ReadmeStore:
+    """以GitHub blob sha为键的README压缩存储，相同内容只保存一份；
+    mcp_full_repos.jsonl中只保存sha引用，需要时再按sha读取"""
+
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+
+    def _path(self, sha: str) -> str:
+        # 按前两位分目录，避免单个目录下文件过多
+        return os.path.join(self.root, sha[:2], f"{sha}.gz")
+
+    def has(self, sha: str) -> bool:
+        return bool(sha) and os.path.exists(self._path(sha))
+
+    def put(self, sha: str, content: str) -> bool:
+        """保存README，已存在时不重复写入，返回是否实际写入"""
+        path = self._path(sha)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(gzip.compress(content.encode("utf-8")))
+        os.replace(tmp_path, path)
+        return True
+
+    def get(self, sha: str):
+        """按sha读取README内容，不存在时返回None"""
+        path = self._path(sha)
+        if not sha or not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
@@ -0,0 +1,92 @@
+import json
+from typing import Dict
+
+from readme_reducer import estimate_tokens
+from structured_output import JsonObjectScanner, extract_json
+
+async def read_chat_stream(response, stop_tag: str = None, stop_at_json_end: bool = False) -> Dict:
+    """逐块读取流式(SSE)chat completion响应，拼接成与非流式响应相同格式的JSON。
+    出现stop_tag(或stop_at_json_end时第一个能解析的JSON对象结束)后立即停止读取并关闭连接，丢弃之后的内容。
+    空闲超时由调用方通过ClientTimeout(sock_read=...)控制"""
+    parts = []
+    length = 0
+    usage = None
+    finish_reason = None
+    stopped = False
+    tail = ""  # 上一块末尾，用于发现跨块的结束标签
+    scanner = JsonObjectScanner() if stop_at_json_end else None
+
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            finish_reason = choice.get("finish_reason") or finish_reason
+            delta = (choice.get("delta") or {}).get("content")
+            if not delta:
+                continue
+            parts.append(delta)
+            length += len(delta)
+            if scanner is not None:
+                offset = 0
+                while offset < len(delta):
+                    end = scanner.feed(delta[offset:])
+                    if end < 0:
+                        break
+                    cut = length - len(delta) + offset + end
+                    content = "".join(parts)[:cut]
+                    if extract_json(content) is not None:
+                        parts, length = [content], cut
+                        stopped = True
+                        break
+                    # 候选对象无法解析(例如说明文字中的{...})，继续查找下一个顶层对象
+                    scanner = JsonObjectScanner()
+                    offset += end
+                if stopped:
+                    break
+            elif stop_tag is not None:
+                window = tail + delta
+                pos = window.find(stop_tag)
+                if pos >= 0:
+                    # 截断到结束标签为止
+                    cut = length - len(window) + pos + len(stop_tag)
+                    content = "".join(parts)[:cut]
+                    parts, length = [content], cut
+                    stopped = True
+                    break
+                tail = window[-(len(stop_tag) - 1):] if len(stop_tag) > 1 else ""
+        if stopped:
+            # 不再接收剩余输出
+            response.close()
+            break
+
+    content = "".join(parts)
+    return {
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop" if stopped else finish_reason
+        }],
+        "usage": usage,
+        "stopped_early": stopped
+    }
+
+def estimate_usage(prompt: str, content: str) -> Dict:
+    """提前停止或服务端未返回用量时按字符数估算token"""
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "estimated": True
+    }
@@ -0,0 +1,143 @@
+import os
+import time
+import sqlite3
+from typing import Dict, Iterable, Optional
+
+# 各阶段名称
+STAGE_SEARCH = "search"    # 第一步：搜索基础信息
+STAGE_README = "readme"    # 第二步：获取README
+STAGE_ANALYZE = "analyze"  # 第三步：LLM分析
+
+# 状态
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"  # 未经完整处理但不需要再处理(例如被预筛选排除)
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_SKIPPED)
+
+# attempts为连续失败的次数，成功或跳过时清零
+COLUMNS = ("full_name", "stage", "status", "attempts", "content_hash", "version",
+           "result_type", "error", "created_at", "updated_at")
+
+def row_finished(row: Dict, max_attempts: int = 1) -> bool:
+    """已完成，或失败次数达到max_attempts不再重试"""
+    return row["status"] in FINISHED_STATUSES or (row["status"] == STATUS_FAILED and row["attempts"] >= max_attempts)
+
+class PendingMarks:
+    """缓冲的状态更新：等对应的JSONL导出落盘(checkpoint)后再一次性写入状态库，
+    避免状态库已记为完成而导出文件中还没有这条记录"""
+
+    def __init__(self, state: "PipelineState"):
+        self.state = state
+        self.marks = []
+
+    def add(self, full_name: str, stage: str, status: str, **fields):
+        self.marks.append(dict(fields, full_name=full_name, stage=stage, status=status))
+
+    def flush(self) -> int:
+        marks, self.marks = self.marks, []
+        if marks:
+            self.state.mark_many(marks)
+        return len(marks)
+
+class PipelineState:
+    """所有阶段共用的处理状态存储(SQLite, WAL模式)，每个仓库每个阶段一行。
+    "是否已处理"通过主键查询完成，每次更新是一个事务；JSONL结果文件只作为导出"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS repo_state (
+                full_name TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                content_hash TEXT,
+                version TEXT,
+                result_type TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (full_name, stage)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_repo_state_stage_status ON repo_state(stage, status)")
+        self.conn.commit()
+
+    def get(self, full_name: str, stage: str) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT * FROM repo_state WHERE full_name = ? AND stage = ?", (full_name, stage)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def is_finished(self, full_name: str, stage: str, max_attempts: int = 1) -> bool:
+        row = self.get(full_name, stage)
+        return row is not None and row_finished(row, max_attempts)
+
+    def mark(self, full_name: str, stage: str, status: str, content_hash: str = None,
+             version: str = None, result_type: str = None, error: str = None):
+        """记录一次处理结果：失败时连续失败次数加一，成功或跳过时清零；content_hash/version未提供时保留原值"""
+        self.mark_many([{
+            "full_name": full_name, "stage": stage, "status": status, "content_hash": content_hash,
+            "version": version, "result_type": result_type, "error": error
+        }])
+
+    def mark_many(self, marks: Iterable[Dict]):
+        """在一个事务中记录多条处理结果，字段同mark"""
+        now = time.time()
+        values = [
+            (m["full_name"], m["stage"], m["status"], 1 if m["status"] == STATUS_FAILED else 0,
+             m.get("content_hash"), m.get("version"), m.get("result_type"), m.get("error"), now, now)
+            for m in marks
+        ]
+        with self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO repo_state (full_name, stage, status, attempts, content_hash, version,
+                                        result_type, error, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(full_name, stage) DO UPDATE SET
+                    status = excluded.status,
+                    attempts = CASE WHEN excluded.status = '{STATUS_FAILED}' THEN repo_state.attempts + 1 ELSE 0 END,
+                    content_hash = COALESCE(excluded.content_hash, repo_state.content_hash),
+                    version = COALESCE(excluded.version, repo_state.version),
+                    result_type = excluded.result_type,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+            """, values)
+
+    def import_rows(self, rows: Iterable[Dict]) -> int:
+        """在一个事务中批量导入旧格式文件中的记录，同一仓库出现多次时保留最后一条"""
+        now = time.time()
+        values = [
+            tuple(row.get(column) for column in COLUMNS[:8]) + (now, now)
+            for row in rows
+        ]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO repo_state ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                values
+            )
+        return len(values)
+
+    def has_stage(self, stage: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM repo_state WHERE stage = ? LIMIT 1", (stage,)
+        ).fetchone() is not None
+
+    def counts(self, stage: str) -> Dict[str, int]:
+        """某个阶段各状态的仓库数"""
+        return dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM repo_state WHERE stage = ? GROUP BY status", (stage,)
+        ).fetchall())
+
+    def stats(self, stage: str) -> str:
+        counts = self.counts(stage)
+        details = ", ".join(f"{status} {count}" for status, count in sorted(counts.items()))
+        return f"状态库[{stage}]: 共 {sum(counts.values())} 个仓库 ({details or '无'})"
@@ -0,0 +1,260 @@
+import re
+import json
+import html
+from typing import Dict, Optional, Tuple
+
+# 分析结果的仓库类型
+REPO_TYPES = ["Server", "Index", "Tool", "Client", "Other"]
+DEPLOYMENT_MODES = ["cloud", "local", "both"]
+
+# 各类响应的JSON Schema，用于支持response_format的provider；同时说明了validate_*接受的字段
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_mcp_related": {"type": "boolean"},
+        "is_mcp_server": {"type": "boolean"},
+        "repo_type": {"type": "string", "enum": REPO_TYPES},
+        "reason": {"type": "string"},
+        "name": {"type": "string"},
+        "author": {"type": "string"},
+        "description": {"type": "string"},
+        "url": {"type": "string"},
+        "github_username": {"type": "string"},
+        "server_name": {"type": "string"},
+        "server_command": {"type": "object"},
+        "params": {"type": "array", "items": {"type": "string"}},
+        "is_command_guessed": {"type": "boolean"},
+        "is_stateless": {"type": "boolean"},
+        "stateless_reason": {"type": "string"},
+        "deployment_mode": {"type": "string", "enum": DEPLOYMENT_MODES},
+        "deployment_reason": {"type": "string"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "score": {"type": "integer", "minimum": 0, "maximum": 100}
+    },
+    "required": ["is_mcp_related", "score"]
+}
+README_SCHEMA = {
+    "type": "object",
+    "properties": {"content": {"type": "string"}},
+    "required": ["content"]
+}
+EASY_INSTALL_SCHEMA = {
+    "type": "object",
+    "properties": {"is_easy_install": {"type": "boolean"}, "reason": {"type": "string"}},
+    "required": ["is_easy_install", "reason"]
+}
+
+# 响应名称(与XML格式的根标签相同) -> JSON Schema
+SCHEMAS = {
+    "mcp_response": ANALYSIS_SCHEMA,
+    "mcp_readme_response": README_SCHEMA,
+    "easy_install_response": EASY_INSTALL_SCHEMA
+}
+
+# XML格式中作为列表处理的字段: 字段 -> 子元素标签
+XML_LIST_FIELDS = {"tags": "tag", "params": "param"}
+
+XML_FIELD = re.compile(r"<([a-z_]+)>(.*?)</\1>", re.S)
+CDATA = re.compile(r"^<!\[CDATA\[(.*)\]\]>$", re.S)
+CODE_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+
+def response_format(kind: str, name: str) -> Optional[Dict]:
+    """按provider支持的类型生成response_format参数：json_schema、json_object，其他值表示不支持"""
+    if kind == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": SCHEMAS[name]}}
+    if kind == "json_object":
+        return {"type": "json_object"}
+    return None
+
+class JsonObjectScanner:
+    """增量扫描文本，找到第一个顶层JSON对象结束的位置(跳过字符串中的括号)，用于流式响应提前停止"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.disabled = False  # 响应不是JSON(例如第一个{之前出现了XML标签)，不再判断结束位置
+
+    def feed(self, chunk: str) -> int:
+        """返回对象结束后的位置(相对chunk)，对象还没有结束时返回-1"""
+        if self.disabled:
+            return -1
+        for i, char in enumerate(chunk):
+            if self.depth == 0 and char == "<":
+                # XML响应中嵌入的server_command等JSON不是响应的结束
+                self.disabled = True
+                return -1
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.depth > 0:
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
+
+def loads_json_object(raw: str) -> Optional[Dict]:
+    """解析一个候选JSON对象，容忍末尾多余的逗号，无法解析时返回None"""
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        try:
+            return json.loads(re.sub(r",\s*([}\]])", r"\1", raw))
+        except json.JSONDecodeError:
+            return None
+
+def extract_json(text: str, name: str = None) -> Optional[Dict]:
+    """从响应中取出第一个能解析的完整JSON对象，容忍代码块标记、前后多余文字和末尾多余的逗号；
+    无法解析的候选(例如说明文字中的{...})会被跳过，继续查找下一个顶层{。对象被包在{name: {...}}中时取内层"""
+    text = CODE_FENCE.sub("", (text or "").strip())
+    pos = 0
+    while True:
+        start = text.find("{", pos)
+        if start < 0:
+            return None
+        end = JsonObjectScanner().feed(text[start:])
+        if end < 0:
+            return None
+        data = loads_json_object(text[start:start + end])
+        if data is not None:
+            break
+        pos = start + end
+    if name is not None and list(data) == [name] and isinstance(data[name], dict):
+        data = data[name]
+    return data
+
+def xml_text(value: str) -> str:
+    value = value.strip()
+    match = CDATA.match(value)
+    return match.group(1).strip() if match else html.unescape(value)
+
+def extract_xml(text: str, root_tag: str) -> Optional[Dict]:
+    """按字段名逐个提取<root_tag>下的字段，不经过XML解析器：
+    字段值中未转义的&、<KEY>之类的内容不会导致整个响应解析失败"""
+    text = text or ""
+    start = text.find(f"<{root_tag}")
+    end = text.rfind(f"</{root_tag}>")
+    if start < 0 or end < start:
+        return None
+    body = text[text.find(">", start) + 1:end]
+    data = {}
+    for match in XML_FIELD.finditer(body):
+        field, value = match.group(1), match.group(2)
+        if field in data:
+            continue
+        if field in XML_LIST_FIELDS:
+            item = XML_LIST_FIELDS[field]
+            data[field] = [xml_text(v) for v in re.findall(rf"<{item}>(.*?)</{item}>", value, re.S)]
+        else:
+            data[field] = xml_text(value)
+    return data
+
+def parse_structured(text: str, name: str) -> Optional[Dict]:
+    """解析JSON或XML格式的响应(按响应内容判断)，返回字段字典，找不到完整的响应时返回None"""
+    text = text or ""
+    xml_start = text.find(f"<{name}")
+    json_start = text.find("{")
+    if xml_start >= 0 and (json_start < 0 or xml_start < json_start):
+        return extract_xml(text, name)
+    return extract_json(text, name)
+
+def to_bool(value) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return None
+
+def to_score(value) -> int:
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return max(0, min(int(value), 100))
+    match = re.search(r"\d+", str(value or ""))
+    return min(int(match.group()), 100) if match else 0
+
+def to_text(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+def to_list(value) -> list:
+    if isinstance(value, list):
+        return [to_text(v) for v in value if v is not None]
+    if isinstance(value, str) and value.strip():
+        return [v.strip() for v in value.split(",") if v.strip()]
+    return []
+
+def to_server_command(value):
+    """server_command应为对象；模型返回JSON字符串时解析，无法解析时保留原始文本"""
+    if isinstance(value, str):
+        try:
+            return json.loads(value.strip())
+        except json.JSONDecodeError:
+            return value
+    return value
+
+def validate_analysis(data: Dict) -> Dict:
+    """校验并规范化主要分析结果(类型转换、枚举值、评分范围)，缺少is_mcp_related时抛出ValueError"""
+    is_mcp_related = to_bool(data.get("is_mcp_related"))
+    if is_mcp_related is None:
+        raise ValueError(f"分析结果缺少有效的is_mcp_related字段: {data.get('is_mcp_related')!r}")
+    score = to_score(data.get("score"))
+    if not is_mcp_related:
+        return {
+            "is_mcp_related": False,
+            "reason": to_text(data.get("reason")) or "未提供原因",
+            "score": score
+        }
+
+    is_mcp_server = bool(to_bool(data.get("is_mcp_server")))
+    types = {t.lower(): t for t in REPO_TYPES}
+    repo_type = types.get(str(data.get("repo_type") or "").strip().lower())
+    if repo_type is None:
+        repo_type = "Server" if is_mcp_server else "Other"
+    result = {
+        "is_mcp_related": True,
+        "is_mcp_server": is_mcp_server,
+        "repo_type": repo_type,
+        "description": to_text(data.get("description"))
+    }
+    if not is_mcp_server:
+        result["reason"] = to_text(data.get("reason"))
+        result["score"] = score
+        return result
+
+    for field in ["name", "author", "url", "github_username", "server_name", "stateless_reason", "deployment_reason"]:
+        if data.get(field) is not None:
+            result[field] = to_text(data[field])
+    for field in ["is_command_guessed", "is_stateless"]:
+        if data.get(field) is not None:
+            result[field] = bool(to_bool(data[field]))
+    if data.get("server_command") is not None:
+        result["server_command"] = to_server_command(data["server_command"])
+    deployment_mode = str(data.get("deployment_mode") or "").strip().lower()
+    if deployment_mode:
+        result["deployment_mode"] = deployment_mode if deployment_mode in DEPLOYMENT_MODES else "both"
+    for field in XML_LIST_FIELDS:
+        if data.get(field) is not None:
+            result[field] = to_list(data[field])
+    result["score"] = score
+    return result
+
+def validate_readme(data: Dict) -> Optional[str]:
+    content = to_text(data.get("content"))
+    return content.strip() if content and content.strip() else None
+
+def validate_easy_install(data: Dict) -> Tuple[Optional[bool], str]:
+    """返回(is_easy_install, 原因)，缺少有效的is_easy_install时为(None, 原因)"""
+    is_easy_install = to_bool(data.get("is_easy_install"))
+    if is_easy_install is None:
+        return None, "LLM响应缺少is_easy_install"
+    return is_easy_install, to_text(data.get("reason")) or "未提供"
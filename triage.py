@@ -0,0 +1,148 @@
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree
+
+# 初筛的分类，与主要分析的repo_type一致，另加NotMCP
+TRIAGE_CATEGORIES = ["Server", "Index", "Tool", "Client", "Other", "NotMCP"]
+
+CATEGORY_GUIDE = """分类:
+- Server: 可被大语言模型通过MCP直接调用的MCP服务器实现
+- Index: 收集、列出MCP服务器的资源列表(如awesome-mcp)
+- Tool: 开发MCP服务器的工具、框架、SDK或库
+- Client: 连接MCP服务器的客户端实现
+- Other: 与MCP相关但不属于上述类别
+- NotMCP: 与Model Context Protocol无关(例如Minecraft的MCP、Microchip芯片等)"""
+
+RESPONSE_FIELDS = """  <category>Server/Index/Tool/Client/Other/NotMCP 之一</category>
+  <confidence>0-100，对分类的把握程度</confidence>
+  <score>0-100，仓库质量评分</score>
+  <reason>一句话说明理由</reason>"""
+
+def format_repo(repo: Dict, readme: str) -> str:
+    topics = ", ".join(repo.get("topics") or [])
+    return f"""仓库: {repo['full_name']}
+描述: {repo.get('description') or ''}
+Topics: {topics}
+README(节选):
+{readme}"""
+
+def build_triage_prompt(repo: Dict, readme: str) -> str:
+    """初筛提示词：只需要给出分类和把握程度，README已压缩到较小的预算"""
+    return f"""判断这个GitHub仓库与MCP（Model Context Protocol，模型上下文协议）的关系，只需给出分类。
+
+{format_repo(repo, readme)}
+
+{CATEGORY_GUIDE}
+
+请严格按照以下XML格式返回，不要添加任何其他内容：
+<triage_response>
+{RESPONSE_FIELDS}
+</triage_response>
+"""
+
+def build_batch_triage_prompt(items: List[Tuple[Dict, str]]) -> str:
+    """一次初筛多个仓库的提示词，items为(仓库, 压缩后的README)列表，结果按full_name对应"""
+    repos = "\n\n".join(
+        f"=== 仓库 {i + 1} ===\n{format_repo(repo, readme)}" for i, (repo, readme) in enumerate(items)
+    )
+    return f"""分别判断以下 {len(items)} 个GitHub仓库与MCP（Model Context Protocol，模型上下文协议）的关系，只需给出分类。
+
+{repos}
+
+{CATEGORY_GUIDE}
+
+请为每个仓库返回一个triage_response，full_name必须与上面的仓库名完全一致，严格按照以下XML格式返回，不要添加任何其他内容：
+<triage_batch>
+<triage_response>
+  <full_name>仓库名</full_name>
+{RESPONSE_FIELDS}
+</triage_response>
+...
+</triage_batch>
+"""
+
+def parse_int(text: Optional[str]) -> int:
+    match = re.search(r"\d+", text or "")
+    return min(int(match.group()), 100) if match else 0
+
+def escape_text(xml_str: str) -> str:
+    # 理由中可能出现未转义的&
+    return re.sub(r"&(?!(amp|lt|gt|quot|apos|#\d+);)", "&amp;", xml_str)
+
+def parse_triage_element(root) -> Optional[Dict]:
+    category = (root.findtext("category") or "").strip()
+    # 兼容大小写和多余空格
+    normalized = {c.lower(): c for c in TRIAGE_CATEGORIES}
+    category = normalized.get(category.replace(" ", "").lower())
+    if category is None:
+        return None
+    return {
+        "category": category,
+        "confidence": parse_int(root.findtext("confidence")),
+        "score": parse_int(root.findtext("score")),
+        "reason": (root.findtext("reason") or "").strip()
+    }
+
+def parse_triage_response(text: str) -> Optional[Dict]:
+    """解析初筛响应，格式无效时返回None(视为不确定，交给主要分析)"""
+    start = text.find("<triage_response")
+    end = text.rfind("</triage_response>")
+    if start < 0 or end < start:
+        return None
+    try:
+        root = ElementTree.fromstring(escape_text(text[start:end + len("</triage_response>")]))
+    except ElementTree.ParseError:
+        return None
+    return parse_triage_element(root)
+
+def parse_triage_batch(text: str) -> Dict[str, Dict]:
+    """解析批量初筛响应，返回full_name -> 分类结果。
+    每个triage_response单独解析，个别条目格式错误不影响其他条目"""
+    results = {}
+    for match in re.finditer(r"<triage_response\b.*?</triage_response>", text, re.S):
+        try:
+            root = ElementTree.fromstring(escape_text(match.group()))
+        except ElementTree.ParseError:
+            continue
+        full_name = (root.findtext("full_name") or "").strip()
+        triage = parse_triage_element(root)
+        if full_name and triage is not None:
+            results[full_name] = triage
+    return results
+
+def should_escalate(triage: Optional[Dict], confidence_threshold: int) -> bool:
+    """MCP服务器、无法解析或把握不足的仓库需要交给强模型做完整分析"""
+    if triage is None:
+        return True
+    return triage["category"] == "Server" or triage["confidence"] < confidence_threshold
+
+class TriageStats:
+    """统计初筛的分类分布和升级到完整分析的比例"""
+
+    def __init__(self):
+        self.categories = Counter()
+        self.escalated = Counter()  # 升级原因 -> 数量
+
+    def record(self, triage: Optional[Dict], escalated: bool):
+        category = triage["category"] if triage is not None else "invalid"
+        self.categories[category] += 1
+        if escalated:
+            if triage is None:
+                reason = "invalid"
+            elif triage["category"] == "Server":
+                reason = "server"
+            else:
+                reason = "low_confidence"
+            self.escalated[reason] += 1
+
+    def summary(self) -> str:
+        total = sum(self.categories.values())
+        escalated = sum(self.escalated.values())
+        rate = escalated / total * 100 if total else 0
+        categories = ", ".join(f"{k} {v}" for k, v in self.categories.most_common())
+        reasons = ", ".join(f"{k} {v}" for k, v in self.escalated.most_common())
+        return (
+            f"初筛 {total} 个仓库 ({categories or '无'})，升级到完整分析 {escalated} 个 ({rate:.1f}%)"
+            + (f"，原因: {reasons}" if reasons else "")
+        )
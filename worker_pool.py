@@ -0,0 +1,79 @@
+import asyncio
+import traceback
+from datetime import datetime
+
+PROGRESS_INTERVAL = 10  # 进度汇报间隔(秒)
+
+async def log(message):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+class Progress:
+    """工作池进度：按实际完成的任务计数，而不是检查协程对象"""
+
+    def __init__(self):
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.producer_done = False
+
+    def __str__(self):
+        if self.producer_done:
+            total = self.queued
+            percent = f" ({self.completed / total * 100:.1f}%)" if total else ""
+            return f"进度: {self.completed}/{total}{percent}, 失败 {self.failed}"
+        return f"进度: {self.completed}/{self.queued}+ (仍在读取输入), 失败 {self.failed}"
+
+async def run_worker_pool(items, worker, num_workers: int, queue_size: int = None, weight=None, on_progress=None):
+    """用有界队列把items(可迭代对象，可以是逐行读取文件的生成器)分发给num_workers个worker协程。
+    队列满时生产者暂停读取，内存占用与输入规模无关。
+    weight(item)用于按权重计数(例如一批仓库按仓库数计)，on_progress(progress)为定期回调的协程函数"""
+    queue = asyncio.Queue(maxsize=queue_size or num_workers * 2)
+    progress = Progress()
+
+    async def producer():
+        try:
+            for item in items:
+                await queue.put(item)
+                progress.queued += weight(item) if weight else 1
+        finally:
+            progress.producer_done = True
+            for _ in range(num_workers):
+                await queue.put(None)
+
+    async def consumer():
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            try:
+                await worker(item)
+            except Exception as e:
+                progress.failed += weight(item) if weight else 1
+                await log(f"任务执行失败: {str(e)}\n{traceback.format_exc()}")
+            finally:
+                progress.completed += weight(item) if weight else 1
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            if on_progress is not None:
+                await on_progress(progress)
+            else:
+                await log(str(progress))
+
+    reporter_task = asyncio.create_task(reporter())
+    try:
+        await asyncio.gather(producer(), *(consumer() for _ in range(num_workers)))
+    finally:
+        reporter_task.cancel()
+        try:
+            await reporter_task
+        except asyncio.CancelledError:
+            pass
+
+    if on_progress is not None:
+        await on_progress(progress)
+    else:
+        await log(str(progress))
+    return progress